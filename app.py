@@ -1,10 +1,12 @@
+import os
+
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import yaml
 
-from src.load_healthautoexport import load_payloads
-from src.compute_phase1 import build_phase1_daily
+from src.daily_cache import load_daily
+from src.export_cache import input_fingerprint, input_paths, push_log_path
 
 st.set_page_config(page_title="Cardio-Protective Dashboard", layout="wide")
 st.title("Cardio-Protective Dashboard — Phase 1")
@@ -12,9 +14,14 @@ st.title("Cardio-Protective Dashboard — Phase 1")
 # ----------------------------
 # Targets
 # ----------------------------
+@st.cache_data
+def parse_targets(text: str):
+    return yaml.safe_load(text)["metrics"]
+
 def load_targets(path="targets.yaml"):
+    # keyed on the file contents, so edits show up on the next rerun
     with open(path, "r") as f:
-        return yaml.safe_load(f)["metrics"]
+        return parse_targets(f.read())
 
 targets = load_targets()
 
@@ -64,65 +71,116 @@ def plot_line(df, col, title, spec_key=None, height=280):
 # Load data
 # ----------------------------
 st.sidebar.header("Data")
-st.sidebar.write("Upload HealthAutoExport-*.json into `/data` in Replit (NOT GitHub).")
+st.sidebar.write("Upload HealthAutoExport-*.json / .csv (or Apple Health's export.xml) into `/data` in Replit (NOT GitHub).")
+if not input_paths("data") and not push_log_path("data").exists():
+    st.error("No HealthAutoExport JSON/CSV files or export.xml found in /data.")
+    st.stop()
+
+# ----------------------------
+# Cached pipeline
+# ----------------------------
+# Every cache below is keyed on input_fingerprint("data"): a stat-only hash of
+# the exports and the push log plus the partial cache key, which already
+# folds in ZONES and METRICS. Widget changes rerun the script but only redo
+# the cheap window slicing. Only the current fingerprint is ever asked for
+# again, so the full-history frames keep one entry and the scorecard one per
+# window choice; older entries are evicted instead of piling up per export.
+# The longest window plus the 30 days its baselines look back: older exports
+# are never parsed (see load_daily)
+WINDOW_CHOICES = [7, 30, 90, 180, 365]
+BASELINE_DAYS = 30
+HISTORY_DAYS = max(WINDOW_CHOICES) + BASELINE_DAYS
+
+def rolling_mean(series, n=7, minp=4):
+    return series.rolling(n, min_periods=minp).mean()
+
+@st.cache_data(show_spinner="Loading exports…", max_entries=1)
+def cached_daily(fingerprint: str) -> pd.DataFrame:
+    # Warm starts read the daily columns from data/.cache; otherwise only new
+    # or changed exports are parsed and the rest come from cached partials
+    df = load_daily("data", workers=os.cpu_count() or 1, history_days=HISTORY_DAYS)
+    # Normalize types
+    df["date"] = pd.to_datetime(df["date"])
+    return df.sort_values("date")
+
+@st.cache_data(max_entries=1)
+def cached_baselines(fingerprint: str) -> pd.DataFrame:
+    df = cached_daily(fingerprint)
+    out = df[["date"]]
+
+    # HRV delta vs baseline (prior 30 days)
+    if "heart_rate_variability" in df.columns:
+        full = df[["date", "heart_rate_variability"]].dropna().copy()
+        full["hrv7"] = rolling_mean(full["heart_rate_variability"], 7)
+        # baseline: previous 30 days rolling mean
+        full["baseline30"] = full["heart_rate_variability"].rolling(BASELINE_DAYS, min_periods=14).mean()
+        full["hrv_delta_pct"] = 100 * (full["hrv7"] - full["baseline30"]) / full["baseline30"]
+        out = out.merge(full[["date", "hrv7", "hrv_delta_pct"]], on="date", how="left")
+
+    # RHR delta vs baseline
+    if "resting_heart_rate" in df.columns:
+        full = df[["date", "resting_heart_rate"]].dropna().copy()
+        full["rhr7"] = rolling_mean(full["resting_heart_rate"], 7)
+        full["baseline30_rhr"] = full["resting_heart_rate"].rolling(BASELINE_DAYS, min_periods=14).mean()
+        full["rhr_delta"] = full["rhr7"] - full["baseline30_rhr"]
+        out = out.merge(full[["date", "rhr7", "rhr_delta"]], on="date", how="left")
+
+    return out
+
+def window_frame(df: pd.DataFrame, baselines: pd.DataFrame, window_days: int) -> pd.DataFrame:
+    cut = df["date"].max() - pd.Timedelta(days=window_days)
+    return df[df["date"] >= cut].merge(baselines, on="date", how="left")
+
+SCORECARD_COLUMNS = [
+    "zone2_pct", "hrr1", "hrv7", "hrv_delta_pct", "rhr7", "rhr_delta",
+    "sleep_score_derived", "alcohol_consumption",
+]
+
+@st.cache_data(max_entries=8)
+def cached_scorecard(fingerprint: str, window_days: int) -> dict:
+    dff = window_frame(cached_daily(fingerprint), cached_baselines(fingerprint), window_days)
+    out = {}
+    for col in SCORECARD_COLUMNS:
+        if col in dff.columns:
+            s = dff[col].dropna()
+            out[col] = float(s.iloc[-1]) if len(s) else None
+    return out
+
 try:
-    payloads = load_payloads("data")
+    fingerprint = input_fingerprint("data")
+    df = cached_daily(fingerprint)
 except Exception as e:
     st.error(f"Failed loading JSON files from /data: {e}")
     st.stop()
 
-if not payloads:
-    st.error("No HealthAutoExport JSON files found in /data.")
-    st.stop()
-
-df = build_phase1_daily(payloads)
 if df.empty:
     st.error("Parsed payloads but produced an empty daily dataset. Likely metric key mismatch.")
     st.stop()
 
-# Normalize types
-df["date"] = pd.to_datetime(df["date"])
-df = df.sort_values("date")
+@st.fragment(run_every=5)
+def watch_inputs():
+    # pushes to src.receiver land in the push log: pick them up within seconds
+    if input_fingerprint("data") != fingerprint:
+        st.rerun()
+
+watch_inputs()
 
 # ----------------------------
 # Time window
 # ----------------------------
 st.sidebar.header("Window")
-window_days = st.sidebar.selectbox("Days", [7, 30, 90, 180, 365], index=1)
-cut = df["date"].max() - pd.Timedelta(days=window_days)
-dff = df[df["date"] >= cut].copy()
-
-# ----------------------------
-# Derived: rolling metrics & deltas
-# ----------------------------
-def rolling_mean(series, n=7, minp=4):
-    return series.rolling(n, min_periods=minp).mean()
-
-# HRV delta vs baseline (prior 30 days)
-if "heart_rate_variability" in dff.columns:
-    full = df[["date", "heart_rate_variability"]].dropna().copy()
-    full["hrv7"] = rolling_mean(full["heart_rate_variability"], 7)
-    # baseline: previous 30 days rolling mean
-    full["baseline30"] = full["heart_rate_variability"].rolling(30, min_periods=14).mean()
-    full["hrv_delta_pct"] = 100 * (full["hrv7"] - full["baseline30"]) / full["baseline30"]
-    dff = dff.merge(full[["date", "hrv7", "hrv_delta_pct"]], on="date", how="left")
-
-# RHR delta vs baseline
-if "resting_heart_rate" in dff.columns:
-    full = df[["date", "resting_heart_rate"]].dropna().copy()
-    full["rhr7"] = rolling_mean(full["resting_heart_rate"], 7)
-    full["baseline30_rhr"] = full["resting_heart_rate"].rolling(30, min_periods=14).mean()
-    full["rhr_delta"] = full["rhr7"] - full["baseline30_rhr"]
-    dff = dff.merge(full[["date", "rhr7", "rhr_delta"]], on="date", how="left")
+window_days = st.sidebar.selectbox("Days", WINDOW_CHOICES, index=1)
+dff = window_frame(df, cached_baselines(fingerprint), window_days)
 
 # ----------------------------
 # Scorecard (7-day rolling)
 # ----------------------------
 st.subheader("Scorecard (7-day rolling)")
 
+scorecard = cached_scorecard(fingerprint, window_days)
+
 def latest_val(col):
-    s = dff[col].dropna()
-    return float(s.iloc[-1]) if len(s) else None
+    return scorecard.get(col)
 
 tiles = st.columns(6)
 
@@ -0,0 +1,53 @@
+"""
+Decode throughput of every available JSON backend over the exports in a
+data directory (default: data):
+
+    python -m scripts.bench_json [data_dir] [--repeat N]
+
+For each backend it times a whole-file load. The streaming reader, with
+and without the phase-1 projection, is timed once: it is pure Python and
+never calls the JSON backend.
+"""
+from __future__ import annotations
+import argparse
+import time
+
+from src import load_healthautoexport as hae
+from src.compute_phase1 import phase1_projection
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("data_dir", nargs="?", default="data")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    paths = hae.export_paths(args.data_dir)
+    if not paths:
+        raise SystemExit(f"No HealthAutoExport-*.json files in {args.data_dir}")
+    mb = sum(p.stat().st_size for p in paths) / 1e6
+    projection = phase1_projection()
+    # (backend, case, fn); "-" marks cases that do not use the backend
+    cases = [(backend, "load_payload", lambda: [hae.load_payload(p) for p in paths]) for backend in hae.JSON_BACKENDS]
+    cases += [
+        ("-", "stream", lambda: [sum(1 for _ in hae.iter_export_records(p)) for p in paths]),
+        ("-", "stream+projection", lambda: [sum(1 for _ in hae.iter_export_records(p, projection=projection)) for p in paths]),
+    ]
+
+    print(f"{len(paths)} files, {mb:.1f} MB")
+    print(f"{'backend':<8} {'case':<18} {'seconds':>8} {'MB/s':>8}")
+    for backend, name, fn in cases:
+        if backend != "-":
+            hae.set_json_backend(backend)
+        s = _best(fn, args.repeat)
+        print(f"{backend:<8} {name:<18} {s:>8.3f} {mb / s:>8.1f}")
+
+if __name__ == "__main__":
+    main()
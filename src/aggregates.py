@@ -0,0 +1,72 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+# Mergeable per-(date, metric) aggregate states, in long format.
+# Every field combines exactly across files, workers and cache entries:
+#   sum, count, sumsq -> added;  min -> min;  max -> max
+#   last -> value of the row with the latest last_ts (epoch seconds)
+KEYS = ["date", "metric"]
+STATE_COLUMNS = ["sum", "count", "min", "max", "sumsq", "last_ts", "last"]
+PARTIAL_COLUMNS = KEYS + STATE_COLUMNS
+_MERGE = {"sum": "sum", "count": "sum", "min": "min", "max": "max", "sumsq": "sum", "last_ts": "max", "last": "last"}
+
+def empty_partial() -> pd.DataFrame:
+    return pd.DataFrame(columns=PARTIAL_COLUMNS)
+
+def aggregate_long(long: pd.DataFrame) -> pd.DataFrame:
+    """
+    (date, metric, value[, ts]) sample rows -> per-day aggregate states.
+    ts (epoch seconds) orders samples for "last"; without it rows count in
+    the order given.
+    """
+    long = long.dropna(subset=["value"])
+    if long.empty:
+        return empty_partial()
+    long = long.assign(sq=long["value"] * long["value"])
+    if "ts" in long:
+        long = long.sort_values("ts", kind="stable")
+    else:
+        long = long.assign(ts=np.nan)
+    return long.groupby(KEYS, as_index=False, sort=True).agg(
+        sum=("value", "sum"),
+        count=("value", "count"),
+        min=("value", "min"),
+        max=("value", "max"),
+        sumsq=("sq", "sum"),
+        last_ts=("ts", "max"),
+        last=("value", "last"),
+    )
+
+def aggregate_samples(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    (date, <metric columns>...) sample rows -> per-day aggregate states.
+    """
+    return aggregate_long(df.melt(id_vars="date", var_name="metric", value_name="value"))
+
+def merge_partials(partials) -> pd.DataFrame:
+    partials = [p for p in partials if p is not None and not p.empty]
+    if not partials:
+        return empty_partial()
+    merged = pd.concat(partials, ignore_index=True)
+    # stable sort so "last" picks the latest sample; ties keep input order
+    merged = merged.sort_values("last_ts", kind="stable", na_position="first")
+    return merged.groupby(KEYS, as_index=False).agg(_MERGE)
+
+def daily_stat(partials: pd.DataFrame, stat: str) -> pd.DataFrame:
+    """
+    Wide (date x metric) frame of one statistic from merged partials.
+      stat: one of STATE_COLUMNS, "mean" or "std" (population)
+    """
+    def field(name):
+        return partials.pivot(index="date", columns="metric", values=name).astype(float)
+
+    if stat in STATE_COLUMNS:
+        return field(stat)
+    n = field("count")
+    mean = field("sum") / n
+    if stat == "mean":
+        return mean
+    if stat == "std":
+        return np.sqrt((field("sumsq") / n - mean * mean).clip(lower=0))
+    raise ValueError(f"Unknown daily statistic: {stat}")
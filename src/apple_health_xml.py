@@ -0,0 +1,225 @@
+from __future__ import annotations
+import gc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from .load_healthautoexport import Record
+from .timestamps import parse_local
+
+# Streaming importer for Apple Health's native export.xml.
+# Emits the same ("metric" | "workout", record) stream as
+# load_healthautoexport.iter_export_records, so the partial cache ingests
+# it unchanged. Elements are cleared as soon as they are read; what is
+# kept in between is compact:
+#   quantity samples: batches of HAE-shaped records, flushed every flush_every
+#   sleep / mindful / workouts: start, end and value strings, vectorized at the end
+#   heart rate: only needed inside workouts, whose windows are known once
+#     the whole file has been read; a second pass keeps the samples inside
+#     them as int64 seconds + float32 bpm, so years of all-day heart rate
+#     are never held
+
+# HKQuantityType -> HealthAutoExport metric name
+QUANTITY_TYPES = {
+    "HKQuantityTypeIdentifierHeartRateVariabilitySDNN": "heart_rate_variability",
+    "HKQuantityTypeIdentifierRestingHeartRate": "resting_heart_rate",
+    "HKQuantityTypeIdentifierRespiratoryRate": "respiratory_rate",
+    "HKQuantityTypeIdentifierAppleSleepingBreathingDisturbances": "breathing_disturbances",
+    "HKQuantityTypeIdentifierNumberOfAlcoholicBeverages": "alcohol_consumption",
+}
+HEART_RATE = "HKQuantityTypeIdentifierHeartRate"
+SLEEP = "HKCategoryTypeIdentifierSleepAnalysis"
+MINDFUL = "HKCategoryTypeIdentifierMindfulSession"
+_ASLEEP = "HKCategoryValueSleepAnalysisAsleep"  # also ...AsleepCore / Deep / REM / Unspecified
+_AWAKE = "HKCategoryValueSleepAnalysisAwake"
+
+def health_xml_paths(data_dir: str = "data") -> List[Path]:
+    """export.xml in data_dir, as dropped in or as unzipped from the Health app."""
+    root = Path(data_dir)
+    return [p for p in (root / "export.xml", root / "apple_health_export" / "export.xml") if p.is_file()]
+
+def _wall_clock(ts: np.ndarray) -> np.ndarray:
+    # back to "YYYY-MM-DD HH:MM:SS ±ZZZZ" so parse_local takes its fast
+    # path; timestamps are local wall-clock time, the offset is not used
+    text = np.datetime_as_string(ts.astype("datetime64[s]"))
+    return np.char.add(np.char.replace(text, "T", " "), " +0000")
+
+def _merge_windows(start: np.ndarray, end: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Sorted, non-overlapping [start, end] windows covering the given ones."""
+    order = np.argsort(start, kind="stable")
+    start, end = start[order], end[order]
+    reach = np.maximum.accumulate(end)
+    first = np.flatnonzero(np.r_[True, start[1:] > reach[:-1]])
+    return start[first], np.maximum.reduceat(end, first)
+
+class _HeartRate:
+    """
+    Heart-rate samples inside the given windows (epoch seconds) as compact
+    arrays; rows are converted and filtered every batch rows.
+    """
+
+    def __init__(self, start: np.ndarray, end: np.ndarray, batch: int = 100_000):
+        self.start, self.end = _merge_windows(start, end)
+        self.batch = batch
+        self.dates: List[str] = []
+        self.values: List[float] = []
+        self.ts: List[np.ndarray] = []
+        self.bpm: List[np.ndarray] = []
+
+    def add(self, date: str, value: float) -> None:
+        self.dates.append(date)
+        self.values.append(value)
+        if len(self.dates) >= self.batch:
+            self._convert()
+
+    def _convert(self) -> None:
+        if self.dates:
+            ts = parse_local(self.dates).astype("datetime64[s]").astype("int64")
+            i = np.searchsorted(self.start, ts, side="right") - 1
+            inside = (i >= 0) & (ts <= self.end[np.maximum(i, 0)])
+            self.ts.append(ts[inside])
+            self.bpm.append(np.asarray(self.values, dtype="float32")[inside])
+            self.dates, self.values = [], []
+            # parse_local leaves pandas reference cycles behind, and the
+            # parser frees as many objects as it makes, so the collector
+            # would not otherwise run until the pass is over
+            gc.collect(1)
+
+    def sorted(self) -> tuple[np.ndarray, np.ndarray]:
+        self._convert()
+        if not self.ts:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        ts, bpm = np.concatenate(self.ts), np.concatenate(self.bpm)
+        order = np.argsort(ts, kind="stable")
+        return ts[order], bpm[order]
+
+def _sleep_records(rows: List[tuple]) -> Iterator[Record]:
+    """
+    One HAE-style sleep_analysis sample per night (keyed by wake-up day):
+    totalSleep / awake hours from the source that recorded the most sleep,
+    so phone and watch copies of the same night aren't added together.
+    """
+    if not rows:
+        return
+    df = pd.DataFrame(rows, columns=["start", "end", "value", "source"])
+    df["start_ts"] = parse_local(df["start"])
+    df["end_ts"] = parse_local(df["end"])
+    hours = (df["end_ts"] - df["start_ts"]).dt.total_seconds() / 3600.0
+    df["asleep"] = hours.where(df["value"].str.startswith(_ASLEEP), 0.0)
+    df["awake"] = hours.where(df["value"] == _AWAKE, 0.0)
+    df["day"] = df["end_ts"].dt.normalize()
+    df = df[(df["asleep"] > 0) | (df["awake"] > 0)]
+    if df.empty:
+        return
+
+    nights = df.groupby(["day", "source"], as_index=False).agg(
+        totalSleep=("asleep", "sum"), awake=("awake", "sum"), end_ts=("end_ts", "max")
+    )
+    nights = nights.sort_values(["day", "totalSleep"]).drop_duplicates("day", keep="last")
+    nights = nights[nights["totalSleep"] > 0]
+    data = [
+        {"date": date, "totalSleep": float(total), "awake": float(awake)}
+        for date, total, awake in zip(_wall_clock(nights["end_ts"].to_numpy()), nights["totalSleep"], nights["awake"])
+    ]
+    yield "metric", {"name": "sleep_analysis", "units": "hr", "data": data}
+
+def _mindful_records(rows: List[tuple]) -> Iterator[Record]:
+    if not rows:
+        return
+    start = parse_local([r[0] for r in rows])
+    minutes = (parse_local([r[1] for r in rows]) - start) / np.timedelta64(60, "s")
+    data = [{"date": r[0], "qty": float(m)} for r, m in zip(rows, minutes) if m > 0]
+    yield "metric", {"name": "mindful_minutes", "units": "min", "data": data}
+
+def _top_level(path: str | Path) -> Iterator[ET.Element]:
+    """Each complete child of the root, cleared again once the caller is done."""
+    context = ET.iterparse(str(path), events=("start", "end"))
+    _, root = next(context)
+    depth = 1
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            # child of a record (metadata, statistics): dropped with its parent
+            continue
+        yield elem
+        # release everything read so far
+        root.clear()
+
+def _workout_heart_rate(path: str | Path, start: np.ndarray, end: np.ndarray) -> _HeartRate:
+    """Second pass: the heart-rate samples that fall inside a workout."""
+    hr = _HeartRate(start, end)
+    for elem in _top_level(path):
+        if elem.tag == "Record" and elem.get("type") == HEART_RATE:
+            value = elem.get("value")
+            if value is not None:
+                hr.add(elem.get("startDate"), float(value))
+    return hr
+
+def _workout_records(path: str | Path, workouts: List[tuple]) -> Iterator[Record]:
+    """Each workout with the heart-rate samples recorded during it."""
+    if not workouts:
+        return
+    start = parse_local([w[0] for w in workouts]).astype("datetime64[s]").astype("int64")
+    end = parse_local([w[1] for w in workouts]).astype("datetime64[s]").astype("int64")
+    ts, bpm = _workout_heart_rate(path, start, end).sorted()
+    lo = np.searchsorted(ts, start, side="left")
+    hi = np.searchsorted(ts, end, side="right")
+    for (s, e, activity), a, b in zip(workouts, lo, hi):
+        w = {"name": activity, "start": s, "end": e}
+        if b > a:
+            dates = _wall_clock(ts[a:b])
+            w["heartRateData"] = [{"date": d, "Avg": float(v)} for d, v in zip(dates.tolist(), bpm[a:b].tolist())]
+        yield "workout", w
+
+def iter_health_xml_records(path: str | Path, flush_every: int = 250_000) -> Iterator[Record]:
+    """
+    Streams ("metric", m) / ("workout", w) records out of an Apple Health
+    export.xml of any size. Quantity records map through QUANTITY_TYPES;
+    sleep, mindful sessions and workouts follow at the end, once the whole
+    file has been read, and workouts take a second pass for their heart rate.
+    """
+    batches: Dict[str, list] = {name: [] for name in QUANTITY_TYPES.values()}
+    held = 0
+    sleep_rows: List[tuple] = []
+    mindful_rows: List[tuple] = []
+    workouts: List[tuple] = []
+
+    for elem in _top_level(path):
+        tag = elem.tag
+        if tag == "Record":
+            kind = elem.get("type")
+            if kind in QUANTITY_TYPES:
+                value = elem.get("value")
+                if value is not None:
+                    batches[QUANTITY_TYPES[kind]].append({"date": elem.get("startDate"), "qty": float(value)})
+                    held += 1
+            elif kind == SLEEP:
+                sleep_rows.append((elem.get("startDate"), elem.get("endDate"), elem.get("value", ""), elem.get("sourceName", "")))
+            elif kind == MINDFUL:
+                mindful_rows.append((elem.get("startDate"), elem.get("endDate")))
+        elif tag == "Workout":
+            workouts.append((elem.get("startDate"), elem.get("endDate"), elem.get("workoutActivityType")))
+
+        if held >= flush_every:
+            for name, data in batches.items():
+                if data:
+                    yield "metric", {"name": name, "data": data}
+            batches = {name: [] for name in QUANTITY_TYPES.values()}
+            held = 0
+
+    for name, data in batches.items():
+        if data:
+            yield "metric", {"name": name, "data": data}
+    yield from _sleep_records(sleep_rows)
+    yield from _mindful_records(mindful_rows)
+    # hold nothing from the first pass while the second one runs
+    batches.clear()
+    sleep_rows.clear()
+    mindful_rows.clear()
+    yield from _workout_records(path, workouts)
@@ -0,0 +1,27 @@
+from __future__ import annotations
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# Cache files are trusted by name, so every writer goes through a private
+# temp file in the same directory and swaps it in with os.replace: readers
+# never see a partial write, and concurrent writers never share a temp path.
+
+def write_atomic(path: Path, write) -> None:
+    """Calls write(tmp) on a fresh temp file next to path, then moves it into place."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def write_json_atomic(path: Path, obj, **kwargs) -> None:
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, **kwargs)
+    write_atomic(path, write)
@@ -1,6 +1,13 @@
 from __future__ import annotations
+from dataclasses import dataclass
+
+import numpy as np
 import pandas as pd
-from dateutil import parser
+
+from .aggregates import aggregate_long, aggregate_samples, daily_stat, merge_partials
+from .load_healthautoexport import Projection, iter_payload_records
+from .timestamps import parse_local, to_days
+from .workouts import WorkoutHR, build_workout_hr, hrr, resample, select, zone_minutes
 
 # Your calibrated zones
 ZONES = {
@@ -10,82 +17,238 @@ ZONES = {
     "Z4": (136, 148),
     "Z5": (149, None),
 }
+# Longest gap between HR buckets credited as zone time (seconds)
+HR_MAX_GAP_S = 60
+# Workout HR streams are binned to this resolution at ingestion (5, 15 or 60 s)
+HR_RESOLUTION_S = 5
+# Workouts with fewer HR buckets than this, as exported, are ignored
+MIN_HR_BUCKETS = 5
+
+# Daily aggregations a metric can declare (see aggregates.daily_stat)
+AGGREGATIONS = {"sum", "mean", "min", "max", "last"}
+
+@dataclass(frozen=True)
+class MetricSpec:
+    """
+      source: metric name in the export
+      key: data field holding the value
+      agg: daily aggregation, one of AGGREGATIONS
+      column: output column (default: source)
+    """
+    source: str
+    key: str = "qty"
+    agg: str = "mean"
+    column: str = ""
+
+    def __post_init__(self):
+        if self.agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation for {self.source}: {self.agg}")
+        if not self.column:
+            object.__setattr__(self, "column", self.source)
+
+# Metric registry: one pass over the exports collects every entry, and one
+# groupby aggregates them. Adding a metric is one line here.
+METRICS = [
+    MetricSpec("heart_rate_variability"),
+    MetricSpec("resting_heart_rate"),
+    MetricSpec("respiratory_rate"),
+    MetricSpec("breathing_disturbances"),
+    MetricSpec("mindful_minutes", agg="sum"),
+    MetricSpec("alcohol_consumption", agg="sum"),
+]
+PHASE1_METRICS = [spec.column for spec in METRICS]
+
+# Workout fields the extractors read; routes, step and energy series are not
+WORKOUT_FIELDS = frozenset({"end", "heartRateData"})
+
+def phase1_projection() -> Projection:
+    """What the streaming decoder has to materialize for build_phase1_daily."""
+    return Projection(
+        metrics=frozenset(spec.source for spec in METRICS) | {"sleep_analysis"},
+        workout_keys=WORKOUT_FIELDS,
+    )
+
+def metric_spec(source: str, key: str = "qty") -> MetricSpec:
+    """The registry entry for source/key, or a plain mean when unregistered."""
+    for spec in METRICS:
+        if spec.source == source and spec.key == key:
+            return spec
+    return MetricSpec(source, key)
+
+def new_columns(metrics) -> dict:
+    """
+    Columnar accumulators filled by feed_record.
+      metrics: MetricSpecs to collect
+      {"metrics": {column: {"date": [...], "value": [...], "key": value key}},
+       "routes": {source: [metrics[column], ...]},
+       "sleep": {"date": [...], "total": [...], "awake": [...]},
+       "workouts": {"end": [...], "hr_date": [...], "hr_avg": [...], "hr_min": [...],
+                    "hr_max": [...], "spans": [(a, b), ...]},
+       "n": samples held}
+    Workouts keep only their HR buckets and end date, never the source dict.
+    """
+    columns = {spec.column: {"date": [], "value": [], "key": spec.key} for spec in metrics}
+    routes = {}
+    for spec in metrics:
+        routes.setdefault(spec.source, []).append(columns[spec.column])
+    return {
+        "metrics": columns,
+        "routes": routes,
+        "sleep": {"date": [], "total": [], "awake": []},
+        "workouts": {"end": [], "hr_date": [], "hr_avg": [], "hr_min": [], "hr_max": [], "spans": []},
+        "n": 0,
+    }
+
+def feed_record(cols: dict, kind: str, rec: dict) -> None:
+    if kind == "metric":
+        _feed_metric(cols, rec)
+    elif kind == "workout":
+        _feed_workout(cols, rec)
+    elif kind == "samples":
+        _feed_samples(cols, rec)
+
+def _feed_samples(cols: dict, batch: dict) -> None:
+    # already columnar (CSV): extend the accumulators in bulk
+    if batch["name"] == "sleep_analysis":
+        sleep = cols["sleep"]
+        sleep["date"].extend(batch["date"])
+        sleep["total"].extend(batch["totalSleep"])
+        sleep["awake"].extend(batch["awake"])
+        cols["n"] += len(batch["date"])
+        return
+    for col in cols["routes"].get(batch["name"], ()):
+        if col["key"] == batch["key"]:
+            col["date"].extend(batch["date"])
+            col["value"].extend(batch["value"])
+            cols["n"] += len(batch["date"])
+
+def _feed_metric(cols: dict, m: dict) -> None:
+    name = m.get("name")
+    if name == "sleep_analysis":
+        sleep = cols["sleep"]
+        for d in m.get("data", []):
+            if "date" not in d:
+                continue
+            total = d.get("totalSleep")
+            if total is None:
+                continue
+            sleep["date"].append(d["date"])
+            sleep["total"].append(float(total))
+            sleep["awake"].append(float(d.get("awake", 0.0) or 0.0))
+            cols["n"] += 1
+    for col in cols["routes"].get(name, ()):
+        value_key, dates, values = col["key"], col["date"], col["value"]
+        start = len(dates)
+        for d in m.get("data", []):
+            if "date" not in d:
+                continue
+            val = d.get(value_key)
+            if val is None:
+                continue
+            dates.append(d["date"])
+            values.append(float(val))
+        cols["n"] += len(dates) - start
+
+def _feed_workout(cols: dict, w: dict) -> None:
+    if not w.get("heartRateData"):
+        return
+    wk = cols["workouts"]
+    start = len(wk["hr_date"])
+    for hp in w["heartRateData"]:
+        if hp.get("Avg") is None or hp.get("date") is None:
+            continue
+        avg = float(hp["Avg"])
+        wk["hr_date"].append(hp["date"])
+        wk["hr_avg"].append(avg)
+        wk["hr_min"].append(avg if hp.get("Min") is None else float(hp["Min"]))
+        wk["hr_max"].append(avg if hp.get("Max") is None else float(hp["Max"]))
+    wk["end"].append(w.get("end"))
+    wk["spans"].append((start, len(wk["hr_date"])))
+    cols["n"] += len(wk["hr_date"]) - start
+
+def demux_records(records, metrics) -> dict:
+    """
+    Routes a stream of ("metric" | "workout", record) pairs into one set of
+    columnar accumulators (see new_columns).
+      metrics: MetricSpecs to collect
+    """
+    cols = new_columns(metrics)
+    for kind, rec in records:
+        feed_record(cols, kind, rec)
+    return cols
 
-def _classify_zone(hr: float) -> str:
-    for z, (lo, hi) in ZONES.items():
-        if lo is None and hr <= hi:
-            return z
-        if hi is None and hr >= lo:
-            return z
-        if lo is not None and hi is not None and lo <= hr <= hi:
-            return z
-    return "UNK"
-
-def _to_day(ts: str) -> pd.Timestamp:
-    # normalize to local-naive day
-    dt = parser.parse(ts)
-    # strip tz safely; keep date
-    dt = dt.replace(tzinfo=None)
-    return pd.Timestamp(dt).normalize()
+def demux_payloads(payloads, metrics) -> dict:
+    """
+    Walks every payload's metrics and workouts exactly once.
+    """
+    return demux_records(iter_payload_records(payloads), metrics)
+
+def _metric_samples(metrics: dict) -> pd.DataFrame:
+    """
+    Every collected metric as one long (date, metric, value, ts) frame;
+    timestamps of all metrics are parsed in a single call.
+    """
+    names = [name for name, col in metrics.items() if col["date"]]
+    dates = [d for name in names for d in metrics[name]["date"]]
+    times = parse_local(dates)
+    return pd.DataFrame({
+        "date": times.astype("datetime64[D]").astype("datetime64[ns]"),
+        "metric": np.repeat(names, [len(metrics[name]["date"]) for name in names]),
+        "value": np.array([v for name in names for v in metrics[name]["value"]], dtype="float64"),
+        "ts": times.astype("datetime64[s]").astype("int64").astype("float64"),
+    })
+
+def _series_frame(spec: MetricSpec, col: dict) -> pd.DataFrame:
+    if not col["date"]:
+        return pd.DataFrame()
+    states = aggregate_long(_metric_samples({spec.column: col}))
+    out = daily_stat(states, spec.agg)
+    out.columns.name = None
+    return out.reset_index()
+
+def _metrics_frame(metrics: dict) -> pd.DataFrame:
+    """
+    Every METRICS column from one aggregation over all collected samples,
+    as _columns_partial does, then each spec's statistic picked per column.
+    """
+    states = aggregate_long(_metric_samples(metrics))
+    if states.empty:
+        return pd.DataFrame()
+    present = set(states["metric"])
+    stats, out = {}, {}
+    for spec in METRICS:
+        if spec.column in present:
+            if spec.agg not in stats:
+                stats[spec.agg] = daily_stat(states, spec.agg)
+            out[spec.column] = stats[spec.agg][spec.column]
+    return pd.DataFrame(out).rename_axis("date").reset_index()
+
+def _sleep_samples(col: dict) -> pd.DataFrame:
+    return pd.DataFrame({
+        "date": to_days(col["date"]),
+        "sleep_total_hr": col["total"],
+        "sleep_awake_hr": col["awake"],
+    })
+
+def _sleep_frame(col: dict) -> pd.DataFrame:
+    if not col["date"]:
+        return pd.DataFrame()
+    return _sleep_samples(col).groupby("date", as_index=False).mean(numeric_only=True)
 
 def extract_metric_series(payloads, metric_name: str, value_key: str = "qty") -> pd.DataFrame:
     """
     Metrics expected shape:
       {"name": "...", "units": "...", "data": [{"date": "...", "qty": 12.3}, ...]}
     """
-    rows = []
-    for p in payloads:
-        root = p.get("data", p)
-        for m in root.get("metrics", []):
-            if m.get("name") != metric_name:
-                continue
-            for d in m.get("data", []):
-                if "date" not in d:
-                    continue
-                val = d.get(value_key)
-                if val is None:
-                    continue
-                rows.append({"date": _to_day(d["date"]), metric_name: float(val)})
-
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-
-    # Sum-type metrics vs mean-type metrics
-    sum_metrics = {"mindful_minutes", "alcohol_consumption"}
-    if metric_name in sum_metrics:
-        df = df.groupby("date", as_index=False)[metric_name].sum()
-    else:
-        df = df.groupby("date", as_index=False)[metric_name].mean()
-
-    return df
+    spec = metric_spec(metric_name, value_key)
+    cols = demux_payloads(payloads, [spec])
+    return _series_frame(spec, cols["metrics"][spec.column])
 
 def extract_sleep_analysis(payloads) -> pd.DataFrame:
     """
     sleep_analysis often includes: totalSleep, awake, rem, deep, core (hours)
     """
-    rows = []
-    for p in payloads:
-        root = p.get("data", p)
-        for m in root.get("metrics", []):
-            if m.get("name") != "sleep_analysis":
-                continue
-            for d in m.get("data", []):
-                if "date" not in d:
-                    continue
-                total = d.get("totalSleep")
-                if total is None:
-                    continue
-                rows.append({
-                    "date": _to_day(d["date"]),
-                    "sleep_total_hr": float(total),
-                    "sleep_awake_hr": float(d.get("awake", 0.0) or 0.0),
-                })
-
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-    return df.groupby("date", as_index=False).mean(numeric_only=True)
+    return _sleep_frame(demux_payloads(payloads, [])["sleep"])
 
 def derive_sleep_score(df_sleep: pd.DataFrame) -> pd.DataFrame:
     """
@@ -109,76 +272,13 @@ def derive_sleep_score(df_sleep: pd.DataFrame) -> pd.DataFrame:
 def compute_zone_minutes_and_hrr1(payloads) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Uses workouts[].heartRateData[] entries with Avg + date.
-    Assumes each HR bucket ~ 1 minute (good enough for trends).
+    Zone minutes use the real time between buckets (gaps capped at HR_MAX_GAP_S).
     HRR1: peak_hr - hr_at_~60s_post_peak (approx using next bucket >= peak+60s).
     """
-    daily_rows = []
-    hrr_rows = []
+    return _zone_minutes_and_hrr1(demux_payloads(payloads, [])["workouts"])
 
-    for p in payloads:
-        root = p.get("data", p)
-        for w in root.get("workouts", []):
-            name = w.get("name", "Unknown")
-            hr_points = w.get("heartRateData") or []
-            if not hr_points:
-                continue
-
-            pts = []
-            for hp in hr_points:
-                if hp.get("Avg") is None or hp.get("date") is None:
-                    continue
-                t = parser.parse(hp["date"]).replace(tzinfo=None)
-                pts.append((t, float(hp["Avg"])))
-
-            if len(pts) < 5:
-                continue
-            pts.sort(key=lambda x: x[0])
-
-            # day bucketing
-            day = _to_day(w["end"]) if w.get("end") else pd.Timestamp(pts[-1][0]).normalize()
-
-            # zone minutes
-            zmins = {z: 0 for z in ZONES}
-            for _, hr in pts:
-                z = _classify_zone(hr)
-                if z in zmins:
-                    zmins[z] += 1
-
-            total = sum(zmins.values())
-            if total == 0:
-                continue
-
-            daily_rows.append({
-                "date": day,
-                "z1_min": zmins["Z1"],
-                "z2_min": zmins["Z2"],
-                "z3_min": zmins["Z3"],
-                "z4_min": zmins["Z4"],
-                "z5_min": zmins["Z5"],
-                "cardio_min": total,
-                "zone2_pct": 100.0 * zmins["Z2"] / total,
-            })
-
-            # HRR1
-            peak_idx = max(range(len(pts)), key=lambda i: pts[i][1])
-            peak_t, peak_hr = pts[peak_idx]
-            target_t = peak_t + pd.Timedelta(seconds=60)
-
-            post_hr = None
-            for t, hr in pts[peak_idx:]:
-                if t >= target_t:
-                    post_hr = hr
-                    break
-            if post_hr is None:
-                post_hr = pts[-1][1]
-
-            hrr_rows.append({
-                "date": day,
-                "hrr1": float(peak_hr - post_hr),
-            })
-
-    daily = pd.DataFrame(daily_rows)
-    hrr = pd.DataFrame(hrr_rows)
+def _zone_minutes_and_hrr1(workouts) -> tuple[pd.DataFrame, pd.DataFrame]:
+    daily, hrr = _workout_rows(workouts)
 
     if not daily.empty:
         daily = daily.groupby("date", as_index=False).sum(numeric_only=True)
@@ -189,30 +289,158 @@ def compute_zone_minutes_and_hrr1(payloads) -> tuple[pd.DataFrame, pd.DataFrame]
 
     return daily, hrr
 
+def _workout_rows(workouts: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    One row per workout: zone minutes and HRR1, keyed by workout day.
+      workouts: the "workouts" columns from new_columns
+    """
+    return workout_rows(workouts_from_columns(workouts))
+
+def workouts_from_columns(workouts: dict) -> WorkoutHR:
+    """
+    Ragged HR layout for demuxed workout columns, resampled to HR_RESOLUTION_S.
+    Workouts with fewer than MIN_HR_BUCKETS buckets are dropped first, so the
+    rule counts buckets as exported, not bins.
+    """
+    # All workouts' HR buckets parse in one batch
+    wh = build_workout_hr(
+        parse_local(workouts["hr_date"]),
+        workouts["hr_avg"],
+        workouts["spans"],
+        end_days(workouts["end"]),
+        workouts["hr_min"],
+        workouts["hr_max"],
+    )
+    return resample(select(wh, wh.lengths >= MIN_HR_BUCKETS), HR_RESOLUTION_S)
+
+def end_days(ends) -> np.ndarray:
+    """Local day of each workout end; NaT where the end is missing."""
+    has_end = np.array([bool(e) for e in ends], dtype=bool)
+    days = np.full(len(ends), np.datetime64("NaT"), dtype="datetime64[ns]")
+    days[has_end] = to_days([e for e in ends if e])
+    return days
+
+def workout_rows(wh: WorkoutHR) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Zone minutes and HRR per workout, computed for all workouts at once.
+    Zone minutes are weighted by real bucket durations (capped at
+    HR_MAX_GAP_S), so per-second and irregular exports aren't inflated.
+    Workouts with no zone time are dropped (short ones already are, see
+    workouts_from_columns).
+    """
+    minutes = zone_minutes(wh, ZONES, HR_MAX_GAP_S)
+    total = minutes.sum(axis=1)
+    keep = np.flatnonzero(total > 0)
+    if not len(keep):
+        return pd.DataFrame(), pd.DataFrame()
+
+    days = wh.day[keep].astype("datetime64[ns]")
+    daily = pd.DataFrame({"date": days})
+    for k, z in enumerate(ZONES):
+        daily[f"{z.lower()}_min"] = minutes[keep, k]
+    daily["cardio_min"] = total[keep]
+    daily["zone2_pct"] = 100.0 * minutes[keep, list(ZONES).index("Z2")] / total[keep]
+
+    recovery = hrr(wh, list(HRR_LAGS.values()))[keep]
+    hrr_rows = pd.DataFrame({"date": days})
+    for k, col in enumerate(HRR_LAGS):
+        hrr_rows[col] = recovery[:, k]
+    return daily, hrr_rows
+
 def build_phase1_daily(payloads) -> pd.DataFrame:
     # Metrics (names are as commonly found in exports; we’ll adjust if yours differs)
-    hrv = extract_metric_series(payloads, "heart_rate_variability")
-    rhr = extract_metric_series(payloads, "resting_heart_rate")
-    rr  = extract_metric_series(payloads, "respiratory_rate")
-    bd  = extract_metric_series(payloads, "breathing_disturbances")
-    mm  = extract_metric_series(payloads, "mindful_minutes")
-    alc = extract_metric_series(payloads, "alcohol_consumption")
-
-    sleep = extract_sleep_analysis(payloads)
+    # One pass over the payloads feeds every extractor below.
+    cols = demux_payloads(payloads, METRICS)
+    series = _metrics_frame(cols["metrics"])
+
+    sleep = _sleep_frame(cols["sleep"])
     sleep_score = derive_sleep_score(sleep)
 
-    workouts_daily, hrr = compute_zone_minutes_and_hrr1(payloads)
+    workouts_daily, hrr = _zone_minutes_and_hrr1(cols["workouts"])
 
-    # merge outer on date
-    dfs = [workouts_daily, hrr, hrv, rhr, rr, bd, mm, alc, sleep_score]
-    base = None
-    for d in dfs:
-        if d is None or d.empty:
-            continue
-        base = d if base is None else base.merge(d, on="date", how="outer")
+    # align every frame on date and join them in one step
+    dfs = [workouts_daily, hrr, series, sleep_score]
+    frames = [d.set_index("date") for d in dfs if d is not None and not d.empty]
+    if not frames:
+        return pd.DataFrame(columns=["date"])
+
+    base = pd.concat(frames, axis=1, join="outer").sort_index()
+    return base.rename_axis("date").reset_index()
 
-    if base is None:
+# ----------------------------
+# Per-day partials
+# ----------------------------
+# Aggregate states per (date, metric) (see aggregates.py). Partials from
+# separate files merge exactly, so each file can be extracted (and cached) alone.
+ZONE_COLUMNS = ["z1_min", "z2_min", "z3_min", "z4_min", "z5_min", "cardio_min"]
+# HRR output column -> seconds after peak; all lags come from one kernel pass
+HRR_LAGS = {"hrr1": 60, "hrr30": 30, "hrr120": 120}
+
+def daily_partials(payloads) -> pd.DataFrame:
+    return partials_from_records(iter_payload_records(payloads))
+
+def partials_from_records(records, flush_every: int = 250_000) -> pd.DataFrame:
+    """
+    Per-day partials from a ("metric" | "workout", record) stream.
+    Accumulated samples are folded into partials every flush_every samples,
+    so memory stays bounded by the largest record plus one flush batch.
+    """
+    parts = []
+    cols = new_columns(METRICS)
+    for kind, rec in records:
+        feed_record(cols, kind, rec)
+        if cols["n"] >= flush_every:
+            parts.append(_columns_partial(cols))
+            cols = new_columns(METRICS)
+    parts.append(_columns_partial(cols))
+    return merge_partials(parts)
+
+def _columns_partial(cols: dict) -> pd.DataFrame:
+    parts = [aggregate_long(_metric_samples(cols["metrics"]))]
+    if cols["sleep"]["date"]:
+        parts.append(aggregate_samples(_sleep_samples(cols["sleep"])))
+
+    workouts, hrr = _workout_rows(cols["workouts"])
+    if not workouts.empty:
+        parts.append(aggregate_samples(workouts[["date"] + ZONE_COLUMNS]))
+        parts.append(aggregate_samples(hrr))
+
+    return merge_partials(parts)
+
+def daily_columns() -> list[str]:
+    """Every column finalize_daily can produce, in its output order."""
+    metrics = [spec.column for spec in METRICS]
+    return ["date"] + ZONE_COLUMNS + ["zone2_pct"] + list(HRR_LAGS) + metrics + ["sleep_score_derived"]
+
+def finalize_daily(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turns merged partials into the same frame build_phase1_daily returns.
+    """
+    if partials.empty:
         return pd.DataFrame(columns=["date"])
 
-    base = base.sort_values("date")
-    return base
+    sums = daily_stat(partials, "sum")
+    means = daily_stat(partials, "mean")
+    out = pd.DataFrame(index=sums.index)
+
+    if "cardio_min" in sums:
+        for c in ZONE_COLUMNS:
+            out[c] = sums[c]
+        out["zone2_pct"] = 100.0 * out["z2_min"] / out["cardio_min"].where(out["cardio_min"] > 0, 1)
+        for col in HRR_LAGS:
+            out[col] = means[col]
+
+    stats = {"sum": sums, "mean": means}
+    for spec in METRICS:
+        if spec.column in sums:
+            if spec.agg not in stats:
+                stats[spec.agg] = daily_stat(partials, spec.agg)
+            out[spec.column] = stats[spec.agg][spec.column]
+
+    if "sleep_total_hr" in sums:
+        sleep = means[["sleep_total_hr", "sleep_awake_hr"]].dropna(subset=["sleep_total_hr"])
+        score = derive_sleep_score(sleep.reset_index())
+        out["sleep_score_derived"] = score.set_index("date")["sleep_score_derived"]
+
+    out.columns.name = None
+    return out.reset_index().sort_values("date")
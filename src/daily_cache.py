@@ -0,0 +1,240 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, writers still never share temp files
+    fcntl = None
+
+from .aggregates import merge_partials
+from .apple_health_xml import health_xml_paths
+from .compute_phase1 import daily_columns, finalize_daily
+from .export_cache import (
+    cache_key,
+    default_cache_dir,
+    input_fingerprint,
+    manifest_digest,
+    merge_cached,
+    push_log_path,
+    update_cache,
+)
+from .export_index import RANGE_SLACK_DAYS, export_ranges, window_paths
+from .load_healthautoexport_csv import csv_paths
+from .sample_store import (
+    apply_push_log,
+    clear_dirty_days,
+    connect,
+    default_db_path,
+    dirty_days,
+    push_partials,
+    pushed_day_range,
+)
+
+# The finished daily frame, one .npy per column (date as int64 ns, the rest
+# float64) plus meta.json recording the input fingerprint it was built from,
+# the partial-cache manifest it matches and the window it keeps. Columns are memory-mapped on
+# load, so a warm start never touches exports; after a change only the days
+# touched by added, edited or removed exports, or by new pushes (see
+# sample_store), are recomputed.
+META = "meta.json"
+LOCK = "daily.lock"
+
+def default_daily_dir(data_dir: str = "data") -> Path:
+    return default_cache_dir(data_dir) / "daily"
+
+def write_daily(
+    daily_dir: Path, df: pd.DataFrame, fingerprint: str, manifest: str | None = None,
+    history_days: int | None = None, first: int | None = None,
+) -> None:
+    # private temp dir per writer, so concurrent rebuilds never share files
+    daily_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=daily_dir.parent, prefix=daily_dir.name + ".", suffix=".tmp"))
+    try:
+        _write_columns(tmp, df, fingerprint, manifest, history_days, first)
+        # swap in as a whole so readers never see a half-written cache
+        old = tmp.with_suffix(".old")
+        if daily_dir.exists():
+            os.replace(daily_dir, old)
+        os.replace(tmp, daily_dir)
+        shutil.rmtree(old, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _write_columns(
+    tmp: Path, df: pd.DataFrame, fingerprint: str, manifest: str | None, history_days: int | None, first: int | None,
+) -> None:
+    columns = [c for c in df.columns if c != "date"]
+    np.save(tmp / "date.npy", df["date"].to_numpy(dtype="datetime64[ns]").view("int64"))
+    for i, c in enumerate(columns):
+        np.save(tmp / f"c{i}.npy", df[c].to_numpy(dtype="float64"))
+    with open(tmp / META, "w", encoding="utf-8") as f:
+        json.dump({
+            "fingerprint": fingerprint,
+            "key": cache_key(),
+            "manifest": manifest,
+            "history_days": history_days,
+            "first": first,
+            "columns": columns,
+            "rows": len(df),
+        }, f)
+
+def read_meta(daily_dir: Path) -> dict | None:
+    try:
+        with open(daily_dir / META, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def read_daily(daily_dir: Path, fingerprint: str | None = None) -> pd.DataFrame | None:
+    """
+    The cached daily frame, or None when missing or built from other inputs.
+    """
+    meta = read_meta(daily_dir)
+    if meta is None:
+        return None
+    if fingerprint is not None and meta["fingerprint"] != fingerprint:
+        return None
+
+    data = {"date": np.load(daily_dir / "date.npy", mmap_mode="r").view("datetime64[ns]")}
+    for i, c in enumerate(meta["columns"]):
+        data[c] = np.load(daily_dir / f"c{i}.npy", mmap_mode="r")
+    return pd.DataFrame(data)
+
+def upsert_days(df: pd.DataFrame, fresh: pd.DataFrame, days) -> pd.DataFrame:
+    """
+    df with the rows for `days` (epoch day numbers) replaced by fresh.
+    Days missing from fresh had all their data removed and are dropped.
+    """
+    if not days:
+        return df
+    dates = pd.DatetimeIndex(np.array(sorted(days), dtype="datetime64[D]"))
+    kept = df[~df["date"].isin(dates)]
+    parts = [kept, fresh] if not fresh.empty else [kept]
+    out = pd.concat(parts, ignore_index=True).sort_values("date", ignore_index=True)
+    # keep finalize_daily's column order; drop columns whose last data went away
+    columns = [c for c in daily_columns() if c in out]
+    gone = [c for c in columns if c not in fresh and c != "date" and out[c].isna().all()]
+    return out[[c for c in columns if c not in gone]]
+
+@contextmanager
+def cache_lock(cache_dir: Path):
+    """
+    Exclusive lock on cache_dir across processes and threads (Streamlit
+    sessions, scripts); released when the block exits.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir / LOCK, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def load_daily(data_dir: str = "data", workers: int = 1, history_days: int | None = None) -> pd.DataFrame:
+    """
+    The daily dataset for data_dir: straight from the columnar cache when the
+    exports and the push log are unchanged. Otherwise the partial cache is
+    updated, pending pushes are applied to the sample store, and only the
+    days either reports dirty are recomputed and merged into the saved
+    frame; a full rebuild happens when there is no usable frame to update.
+    With history_days, only the latest day with data and the history_days
+    days before it are kept, and exports whose indexed date range ends
+    earlier are neither parsed nor read (see update_window).
+    Concurrent calls take turns (cache_lock): the first one rebuilds, the
+    others then find the frame fresh.
+    """
+    with cache_lock(default_cache_dir(data_dir)):
+        return _load_daily(data_dir, workers, history_days)
+
+def update_window(data_dir: str, cache_dir: Path, workers: int, history_days: int | None, pushed=None):
+    """
+    update_cache for the exports that may hold the last history_days days of
+    data; pushed is the (first, last) day of the pushed data, if any.
+    Returns (manifest of those exports, dirty days, first day kept), the
+    first day being None when every day is kept.
+    """
+    if history_days is None:
+        manifest, dirty = update_cache(data_dir, cache_dir, workers)
+        return manifest, dirty, None
+
+    # guess the latest day from the index, then check it against the days
+    # the selected exports actually hold: a guess that came out too late
+    # widens the selection, so it always covers the window.
+    # CSV exports and export.xml have no cheap date range: they always take part
+    always = csv_paths(data_dir) + health_xml_paths(data_dir)
+    guess = [r[1] - RANGE_SLACK_DAYS for r in export_ranges(data_dir, cache_dir).values() if r]
+    guess += [pushed[1]] if pushed else []
+    first = max(guess) - history_days if guess else None
+    dirty: set = set()
+    while True:
+        start = np.datetime64(first, "D") if first is not None else None
+        paths = window_paths(data_dir, start, None, cache_dir) + always
+        manifest, changed = update_cache(data_dir, cache_dir, workers, paths=paths)
+        dirty |= changed
+        manifest = {str(p): manifest[str(p)] for p in paths}
+        ends = [max(e["days"]) for e in manifest.values() if e["days"]] + ([pushed[1]] if pushed else [])
+        if not ends:
+            return manifest, dirty, None
+        if first is None or max(ends) - history_days >= first:
+            return manifest, dirty, max(ends) - history_days
+        first = max(ends) - history_days
+
+def _load_daily(data_dir: str, workers: int, history_days: int | None) -> pd.DataFrame:
+    daily_dir = default_daily_dir(data_dir)
+    cache_dir = default_cache_dir(data_dir)
+    fingerprint = input_fingerprint(data_dir)
+    meta = read_meta(daily_dir)
+    if meta is not None and meta["fingerprint"] == fingerprint and meta.get("history_days") == history_days:
+        return read_daily(daily_dir)
+
+    # the frame is only a valid base if it matches the manifest as it was
+    # before this update; anything else (other key, cache wiped) rebuilds
+    base_ok = (
+        meta is not None
+        and meta.get("key") == cache_key()
+        and meta.get("manifest") is not None
+        and meta["manifest"] == manifest_digest(cache_dir)
+    )
+
+    # pushed data lives in the sample store, only opened once there is some
+    conn = None
+    if push_log_path(data_dir).exists() or default_db_path(data_dir).exists():
+        conn = connect(default_db_path(data_dir))
+        apply_push_log(conn, push_log_path(data_dir))
+    # read the marks before the data: a push landing in between stays marked
+    pushed, upto = dirty_days(conn) if conn else ([], 0)
+    pushed_range = pushed_day_range(conn) if conn else None
+
+    manifest, dirty, first = update_window(data_dir, cache_dir, workers, history_days, pushed_range)
+    # a base starting after the window would miss days: rebuild instead
+    if base_ok and meta.get("first") is not None:
+        base_ok = first is not None and meta["first"] <= first
+
+    def kept(days) -> set:
+        return set(days) if first is None else {d for d in days if d >= first}
+
+    if base_ok:
+        days = kept(dirty | set(pushed))
+        base = read_daily(daily_dir)
+        if first is not None:
+            base = base[base["date"] >= np.datetime64(first, "D")]
+        fresh = merge_partials([merge_cached(cache_dir, manifest, days), push_partials(conn, days) if conn else None])
+        df = upsert_days(base.copy(), finalize_daily(fresh), days)
+    elif first is None:
+        df = finalize_daily(merge_partials([merge_cached(cache_dir, manifest), push_partials(conn) if conn else None]))
+    else:
+        days = kept(d for e in manifest.values() for d in e["days"])
+        if pushed_range:
+            days |= kept(range(pushed_range[0], pushed_range[1] + 1))
+        df = finalize_daily(merge_partials([merge_cached(cache_dir, manifest, days), push_partials(conn, days) if conn else None]))
+    write_daily(daily_dir, df, fingerprint, manifest_digest(cache_dir), history_days, first)
+    if conn:
+        clear_dirty_days(conn, pushed, upto)
+        conn.close()
+    return df
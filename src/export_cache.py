@@ -0,0 +1,236 @@
+from __future__ import annotations
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import merge_partials
+from .atomic import write_atomic, write_json_atomic
+from .apple_health_xml import health_xml_paths, iter_health_xml_records
+from .compute_phase1 import HR_MAX_GAP_S, HR_RESOLUTION_S, HRR_LAGS, METRICS, ZONES, partials_from_records, phase1_projection
+from .load_healthautoexport import export_paths, iter_export_records
+from .load_healthautoexport_csv import csv_paths, iter_csv_records
+
+# Per-file cache of extracted per-day partials.
+# manifest.json maps each export path to its size, mtime, sha256 and the
+# epoch days its data touches; the partial itself is stored as
+# <sha256>.<cache_key()>.pkl next to it.
+# Bump CACHE_VERSION whenever the partial layout or extraction rules change;
+# edits to ZONES, HR_MAX_GAP_S, HR_RESOLUTION_S, HRR_LAGS or the METRICS
+# registry change the key on their own.
+MANIFEST = "manifest.json"
+CACHE_VERSION = 12
+# Append-only log of data pushed to the receiver (see sample_store). It is
+# input, not cache, so it lives next to the exports rather than in .cache
+PUSH_LOG = "push.wal"
+
+def cache_key() -> str:
+    config = hashlib.sha256(repr((sorted(ZONES.items()), HR_MAX_GAP_S, HR_RESOLUTION_S, METRICS, sorted(HRR_LAGS.items()))).encode()).hexdigest()[:12]
+    return f"v{CACHE_VERSION}-{config}"
+
+def default_cache_dir(data_dir: str = "data") -> Path:
+    return Path(data_dir) / ".cache"
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def read_manifest(cache_dir: Path) -> Dict[str, Any]:
+    try:
+        with open(cache_dir / MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get("version") != cache_key():
+        return {}
+    return manifest["files"]
+
+def write_manifest(cache_dir: Path, manifest: Dict[str, Any]) -> None:
+    write_json_atomic(cache_dir / MANIFEST, {"version": cache_key(), "files": manifest}, indent=1, sort_keys=True)
+
+def push_log_path(data_dir: str = "data") -> Path:
+    return Path(data_dir) / PUSH_LOG
+
+def input_paths(data_dir: str = "data") -> List[Path]:
+    """Every input in data_dir: HealthAutoExport JSON and CSV files, then export.xml."""
+    return export_paths(data_dir) + csv_paths(data_dir) + health_xml_paths(data_dir)
+
+def iter_input_records(path: str | Path):
+    """The (kind, record) stream of one input, whichever format it is in."""
+    path = Path(path)
+    if path.suffix == ".xml":
+        return iter_health_xml_records(path)
+    if path.suffix == ".csv":
+        return iter_csv_records(path)
+    return iter_export_records(path, projection=phase1_projection())
+
+def input_fingerprint(data_dir: str = "data") -> str:
+    """
+    Stat-only fingerprint of the exports and the push log (path, size,
+    mtime) plus the cache key. Cheap enough to check on every load without
+    reading any file.
+    """
+    h = hashlib.sha256(cache_key().encode())
+    for path in input_paths(data_dir):
+        st = path.stat()
+        h.update(f"\0{path}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+    log = push_log_path(data_dir)
+    if log.exists():
+        st = log.stat()
+        h.update(f"\0{log}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+def _is_fresh(entry: Dict[str, Any] | None, st: os.stat_result) -> bool:
+    return bool(entry) and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+
+def extract_file(path: str | Path) -> pd.DataFrame:
+    """
+    Per-day partials for one export. Top-level so process-pool workers can
+    run it and ship back only the compact partial.
+    """
+    return partials_from_records(iter_input_records(path))
+
+def _pool_context():
+    """
+    forkserver where the platform has it: workers fork from a single-threaded
+    server that has this module imported already, so they start fast and
+    safe. Elsewhere (Windows) spawn, which pays the imports per worker.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+def extract_files(paths, workers: int = 1) -> List[pd.DataFrame]:
+    """
+    Partials for each path, in order. With workers > 1 files are spread over
+    a process pool; each worker returns its file's partial, never the payload.
+    Workers never fork the caller: a forked copy of a threaded parent
+    (Streamlit's server) can inherit locks held by other threads.
+    """
+    paths = list(paths)
+    if workers <= 1 or len(paths) <= 1:
+        return [extract_file(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths)), mp_context=_pool_context()) as pool:
+        return list(pool.map(extract_file, paths))
+
+def _partial_days(partial: pd.DataFrame) -> List[int]:
+    """Calendar days a partial touches, as epoch day numbers."""
+    days = pd.DatetimeIndex(partial["date"].unique()).values.astype("datetime64[D]").astype("int64")
+    return sorted(days.tolist())
+
+def manifest_digest(cache_dir: Path) -> str | None:
+    try:
+        with open(cache_dir / MANIFEST, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def update_cache(data_dir: str = "data", cache_dir: str | Path | None = None, workers: int = 1, paths=None):
+    """
+    Brings the manifest and cached partials in line with data_dir.
+    Files whose size+mtime (or, failing that, content hash) match the
+    manifest are left alone; only new or changed files are parsed, across
+    `workers` processes when more than one.
+    With `paths`, only those exports are checked; entries for the other
+    exports still on disk are kept as they are.
+    Returns (manifest, dirty days): every calendar day touched by a file
+    that was added, changed or removed, before or after the change.
+    """
+    cache_dir = Path(cache_dir) if cache_dir else default_cache_dir(data_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    old = read_manifest(cache_dir)
+    manifest: Dict[str, Any] = {}
+    dirty: set = set()
+    todo = []
+
+    on_disk = input_paths(data_dir)
+    if paths is not None:
+        selected = {str(p) for p in paths}
+        for path in on_disk:
+            if str(path) not in selected and str(path) in old:
+                manifest[str(path)] = old[str(path)]
+        on_disk = [p for p in on_disk if str(p) in selected]
+
+    for path in on_disk:
+        key = str(path)
+        st = path.stat()
+        entry = old.get(key)
+        if _is_fresh(entry, st) and (cache_dir / entry["partial"]).exists():
+            manifest[key] = entry
+            continue
+
+        digest = file_sha256(path)
+        manifest[key] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": digest,
+            "partial": f"{digest}.{cache_key()}.pkl",
+        }
+        partial_exists = (cache_dir / manifest[key]["partial"]).exists()
+        if entry and entry["partial"] == manifest[key]["partial"] and partial_exists:
+            # touched but same content
+            manifest[key]["days"] = entry["days"]
+            continue
+        if entry:
+            dirty.update(entry["days"])
+        if partial_exists:
+            # copied from another known export: reuse its partial
+            manifest[key]["days"] = _partial_days(pd.read_pickle(cache_dir / manifest[key]["partial"]))
+            dirty.update(manifest[key]["days"])
+        else:
+            todo.append(path)
+
+    for path, partial in zip(todo, extract_files(todo, workers)):
+        entry = manifest[str(path)]
+        write_atomic(cache_dir / entry["partial"], partial.to_pickle)
+        entry["days"] = _partial_days(partial)
+        dirty.update(entry["days"])
+
+    for key in set(old) - set(manifest):
+        dirty.update(old[key]["days"])
+
+    # drop partials no longer referenced by any export (or from older versions)
+    live = {e["partial"] for e in manifest.values()}
+    for stale in cache_dir.glob("*.pkl"):
+        if stale.name not in live:
+            stale.unlink(missing_ok=True)
+
+    write_manifest(cache_dir, manifest)
+    return manifest, dirty
+
+def merge_cached(cache_dir: Path, manifest: Dict[str, Any], days=None) -> pd.DataFrame:
+    """
+    Merged partials from the manifest's files; with `days` (epoch day
+    numbers) only files touching those days are read, and only those days kept.
+    """
+    if days is None:
+        return merge_partials(pd.read_pickle(cache_dir / e["partial"]) for e in manifest.values())
+    days = set(days)
+    wanted = pd.DatetimeIndex(np.array(sorted(days), dtype="datetime64[D]"))
+    parts = []
+    for entry in manifest.values():
+        if days.isdisjoint(entry["days"]):
+            continue
+        partial = pd.read_pickle(cache_dir / entry["partial"])
+        parts.append(partial[partial["date"].isin(wanted)])
+    return merge_partials(parts)
+
+def load_partials(data_dir: str = "data", cache_dir: str | Path | None = None, workers: int = 1) -> pd.DataFrame:
+    """
+    Merged per-day partials for every export in data_dir; only new or
+    changed files are parsed (see update_cache).
+    """
+    cache_dir = Path(cache_dir) if cache_dir else default_cache_dir(data_dir)
+    manifest, _ = update_cache(data_dir, cache_dir, workers)
+    return merge_cached(cache_dir, manifest)
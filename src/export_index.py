@@ -0,0 +1,104 @@
+from __future__ import annotations
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .atomic import write_json_atomic
+from .load_healthautoexport import export_paths, export_streams
+from .timestamps import day_number, day_range
+
+# Per-file index of the days each export covers, so windowed loads skip
+# files that cannot contribute. index.json keys entries by path with size
+# and mtime, so edited files are indexed again.
+#   days: first and last day the export can cover, from the filename
+#         (HealthAutoExport-YYYY-MM-DD-YYYY-MM-DD.json) when it follows the
+#         pattern, otherwise from a byte scan of the timestamps in the file
+INDEX = "index.json"
+INDEX_VERSION = 3
+_NAME = re.compile(r"HealthAutoExport-(\d{4}-\d{2}-\d{2})-(\d{4}-\d{2}-\d{2})\.(?:json|json\.gz|json\.zst|zip)$")
+_STAMP = re.compile(rb'"(?:date|end)"\s*:\s*"(\d{4}-\d{2}-\d{2})')
+# Filename dates follow the exporting device's zone, and sleep and workouts
+# can straddle midnight: widen every range by this many days on each side
+RANGE_SLACK_DAYS = 1
+
+def read_index(cache_dir: Path) -> Dict[str, Any]:
+    try:
+        with open(cache_dir / INDEX, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index["files"]
+
+def write_index(cache_dir: Path, index: Dict[str, Any]) -> None:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(cache_dir / INDEX, {"version": INDEX_VERSION, "files": index}, indent=1, sort_keys=True)
+
+def filename_range(path: Path) -> tuple[int, int] | None:
+    m = _NAME.search(Path(path).name)
+    if not m:
+        return None
+    lo, hi = day_number(m.group(1)), day_number(m.group(2))
+    return (lo, hi) if lo <= hi else None
+
+def probe_range(path: Path, chunk_size: int = 1 << 20) -> tuple[int, int] | None:
+    """
+    First and last day of any date or end timestamp in the file, from a
+    regex scan of the (decompressed) bytes, no JSON decoding.
+    """
+    lo = hi = None
+    tail = b""
+    for f in export_streams(path):
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            buf = tail + chunk
+            for m in _STAMP.finditer(buf):
+                day = m.group(1)
+                lo = day if lo is None or day < lo else lo
+                hi = day if hi is None or day > hi else hi
+            # keep enough to complete a stamp cut at the chunk boundary
+            tail = buf[-64:]
+    if lo is None:
+        return None
+    return day_number(lo.decode()), day_number(hi.decode())
+
+def update_index(data_dir: str = "data", cache_dir: str | Path | None = None) -> Dict[str, Any]:
+    """
+    The index entry of every export in data_dir (see above). Unchanged
+    files come from index.json, others are indexed and saved.
+    """
+    cache_dir = Path(cache_dir) if cache_dir else Path(data_dir) / ".cache"
+    old = read_index(cache_dir)
+    index = {}
+    for path in export_paths(data_dir):
+        key = str(path)
+        st = path.stat()
+        entry = old.get(key)
+        if not (entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns):
+            found = filename_range(path) or probe_range(path)
+            days = [found[0] - RANGE_SLACK_DAYS, found[1] + RANGE_SLACK_DAYS] if found else None
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "days": days}
+        index[key] = entry
+    if index != old:
+        write_index(cache_dir, index)
+    return index
+
+def export_ranges(data_dir: str = "data", cache_dir: str | Path | None = None) -> Dict[str, List[int] | None]:
+    """
+    {path: [first day, last day]} (epoch days, slack included) for every
+    export in data_dir; None when no range could be found.
+    """
+    return {key: entry["days"] for key, entry in update_index(data_dir, cache_dir).items()}
+
+def window_paths(data_dir: str = "data", start=None, end=None, cache_dir: str | Path | None = None) -> List[Path]:
+    """
+    Exports that may hold data for [start, end] (inclusive days; None =
+    open). Files without a known range are always kept.
+    """
+    lo, hi = day_range(start, end)
+    ranges = export_ranges(data_dir, cache_dir)
+    return [
+        path for path in export_paths(data_dir)
+        if ranges[str(path)] is None or (ranges[str(path)][0] <= hi and ranges[str(path)][1] >= lo)
+    ]
@@ -1,13 +1,174 @@
+from __future__ import annotations
+import gzip
+import io
 import json
+import os
+import re
+import warnings
+import zipfile
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import IO, Any, Dict, Iterator, List, Tuple, TypedDict, Union
 
-def load_payloads(data_dir: str = "data") -> List[Dict[str, Any]]:
-    payloads: List[Dict[str, Any]] = []
-    for p in sorted(Path(data_dir).glob("HealthAutoExport-*.json")):
-        with open(p, "r", encoding="utf-8") as f:
-            payloads.append(json.load(f))
-    return payloads
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ----------------------------
+# Record shapes
+# ----------------------------
+# What the extractors read; exports carry more keys (units, source, ...).
+# Annotations only: records are plain dicts and nothing checks them at runtime.
+class Sample(TypedDict, total=False):
+    date: str
+    qty: float
+    totalSleep: float
+    awake: float
+
+class MetricRecord(TypedDict, total=False):
+    name: str
+    units: str
+    data: List[Sample]
+
+class HeartRateSample(TypedDict, total=False):
+    date: str
+    Avg: float
+    Min: float
+    Max: float
+
+class WorkoutRecord(TypedDict, total=False):
+    name: str
+    start: str
+    end: str
+    heartRateData: List[HeartRateSample]
+
+class SampleBatch(TypedDict, total=False):
+    """Columnar samples of one metric field (CSV exports)."""
+    name: str
+    key: str
+    date: List[str]
+    value: List[float]
+    totalSleep: List[float]
+    awake: List[float]
+
+# ("metric", MetricRecord), ("workout", WorkoutRecord) or ("samples", SampleBatch)
+Record = Tuple[str, Union[MetricRecord, WorkoutRecord, SampleBatch]]
+
+# ----------------------------
+# JSON backend
+# ----------------------------
+# orjson when installed, otherwise the stdlib; HEALTH_JSON_BACKEND=json
+# forces the stdlib. orjson has no incremental decode, so it only serves
+# whole-document reads (load_payload, pushed payloads); ingestion keeps the
+# projecting pull reader, whose memory does not grow with the file.
+JSON_BACKENDS = ["json"] + (["orjson"] if orjson is not None else [])
+
+def _env_backend() -> str:
+    name = os.environ.get("HEALTH_JSON_BACKEND")
+    if not name:
+        return JSON_BACKENDS[-1]
+    if name not in JSON_BACKENDS:
+        warnings.warn(
+            f"HEALTH_JSON_BACKEND={name!r} is not available (have: {', '.join(JSON_BACKENDS)}); using json"
+        )
+        return "json"
+    return name
+
+_backend = _env_backend()
+
+def set_json_backend(name: str) -> None:
+    global _backend
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"JSON backend {name!r} is not available (have: {', '.join(JSON_BACKENDS)})")
+    _backend = name
+
+def json_backend() -> str:
+    return _backend
+
+def json_loads(text: str | bytes) -> Any:
+    if _backend == "orjson":
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # NaN / Infinity literals and huge ints are stdlib-only
+            pass
+    return json.loads(text)
+
+@dataclass(frozen=True)
+class Projection:
+    """
+    What the streaming decoder materializes; everything else is skipped.
+      metrics: metric names to keep (None = all)
+      workout_keys: workout fields to keep (None = all)
+    """
+    metrics: frozenset | None = None
+    workout_keys: frozenset | None = None
+
+# ----------------------------
+# Files
+# ----------------------------
+# Plain exports plus archived ones: gzip, zstd (needs zstandard) and zip
+# (every *.json member, in name order, read as one export; macOS metadata
+# entries are skipped).
+EXPORT_PATTERNS = [
+    "HealthAutoExport-*.json",
+    "HealthAutoExport-*.json.gz",
+    "HealthAutoExport-*.json.zst",
+    "HealthAutoExport-*.zip",
+]
+
+def export_paths(data_dir: str = "data") -> List[Path]:
+    return sorted(p for pattern in EXPORT_PATTERNS for p in Path(data_dir).glob(pattern))
+
+def _is_export_member(name: str) -> bool:
+    # Finder's Compress adds __MACOSX/._*.json resource forks next to the real files
+    base = name.rsplit("/", 1)[-1]
+    return name.endswith(".json") and not name.startswith("__MACOSX/") and not base.startswith(".")
+
+def export_streams(path: Path) -> Iterator[IO[bytes]]:
+    """
+    Decompressed byte stream of every JSON document in an export, opened
+    one at a time and decompressed on the fly (no temp files).
+    """
+    path = Path(path)
+    name = path.name
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path) as z:
+            for member in sorted(n for n in z.namelist() if _is_export_member(n)):
+                with z.open(member) as f:
+                    yield f
+    elif name.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield f
+    elif name.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError(f"{name}: install zstandard to read .zst exports")
+        with open(path, "rb") as raw, zstandard.ZstdDecompressor().stream_reader(raw) as f:
+            yield f
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+def load_payload(path: Path, projection: Projection | None = None) -> Dict[str, Any]:
+    if projection is None:
+        docs = [json_loads(f.read()) for f in export_streams(path)]
+        if len(docs) == 1:
+            return docs[0]
+        projection = Projection()
+    # only what the projection asks for, decoded from the stream
+    root: Dict[str, Any] = {"metrics": [], "workouts": []}
+    for kind, rec in iter_export_records(path, projection=projection):
+        root[kind + "s"].append(rec)
+    return {"data": root}
+
+def load_payloads(data_dir: str = "data", projection: Projection | None = None) -> List[Dict[str, Any]]:
+    return [load_payload(p, projection) for p in export_paths(data_dir)]
 
 def get_root(payload: Dict[str, Any]) -> Dict[str, Any]:
     # HealthAutoExport typically nests under "data"
@@ -22,3 +183,190 @@ def iter_workouts(payload: Dict[str, Any]):
     root = get_root(payload)
     for w in root.get("workouts", []):
         yield w
+
+def iter_payload_records(payloads) -> Iterator[Record]:
+    for p in payloads:
+        for m in iter_metrics(p):
+            yield "metric", m
+        for w in iter_workouts(p):
+            yield "workout", w
+        # columnar batches, only in payloads built from CSV exports
+        for b in get_root(p).get("samples", []):
+            yield "samples", b
+
+# ----------------------------
+# Streaming decode
+# ----------------------------
+_WS = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9eE.+\-]*\Z")
+# Everything up to the next bracket that opens or closes a container:
+# plain tokens, whole strings and whole flat objects (no nested containers,
+# like route points or samples). Unrolled loops, so no runaway backtracking.
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_FLAT_OBJECT = r'\{[^"\[\]{}]*(?:' + _STRING + r'[^"\[\]{}]*)*\}'
+_SKIP = re.compile(r'[^"\[\]{}]*(?:(?:' + _STRING + '|' + _FLAT_OBJECT + r')[^"\[\]{}]*)*')
+
+class _JsonStream:
+    """
+    Minimal pull reader over a text file: walks objects/arrays token by token
+    and decodes one value at a time, so only the current value is in memory.
+    """
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, n: int = 0) -> bool:
+        if self.eof:
+            return False
+        if self.pos >= self.chunk_size:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(n or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"Expected {ch!r} but found {got!r} in JSON stream")
+        self.pos += 1
+
+    def value(self) -> Any:
+        while True:
+            self.peek()
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # value spans past the buffer: grow geometrically and retry
+                if self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    continue
+                raise
+            # a bare number may continue in the next chunk
+            if isinstance(obj, (int, float)) and _NUMBER_TAIL.match(self.buf, end) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def skip(self) -> None:
+        """
+        Steps over one value without decoding it: containers are walked by
+        bracket depth, with runs of strings and flat objects (the bulky
+        route and per-sample lists) matched by a single regex.
+        """
+        if self.peek() not in "[{":
+            self.value()
+            return
+        self.pos += 1
+        depth = 1
+        while True:
+            self.pos = _SKIP.match(self.buf, self.pos).end()
+            if self.pos == len(self.buf) or self.buf[self.pos] == '"':
+                # cut off by the end of the buffer
+                if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise ValueError("Unterminated value in JSON stream")
+                continue
+            depth += 1 if self.buf[self.pos] in "[{" else -1
+            self.pos += 1
+            if depth == 0:
+                return
+
+    def _next_item(self, close: str) -> bool:
+        ch = self.peek()
+        self.pos += 1
+        if ch == close:
+            return False
+        if ch != ",":
+            raise ValueError(f"Expected ',' or {close!r} but found {ch!r} in JSON stream")
+        return True
+
+    def iter_array(self) -> Iterator[None]:
+        """Yields once per element; the caller consumes the element."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if not self._next_item("]"):
+                return
+
+    def iter_object(self) -> Iterator[str]:
+        """Yields each key; the caller consumes the value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if not self._next_item("}"):
+                return
+
+def _metric_record(stream: _JsonStream, names) -> MetricRecord | None:
+    if names is None:
+        return stream.value()
+    m: MetricRecord = {}
+    for key in stream.iter_object():
+        if key == "data" and "name" in m and m["name"] not in names:
+            stream.skip()
+        else:
+            m[key] = stream.value()
+    return m if m.get("name") in names else None
+
+def _workout_record(stream: _JsonStream, keys) -> WorkoutRecord:
+    if keys is None:
+        return stream.value()
+    w: WorkoutRecord = {}
+    for key in stream.iter_object():
+        if key in keys:
+            w[key] = stream.value()
+        else:
+            stream.skip()
+    return w
+
+def _iter_root(stream: _JsonStream, projection: Projection) -> Iterator[Record]:
+    for key in stream.iter_object():
+        if key == "metrics" and stream.peek() == "[":
+            for _ in stream.iter_array():
+                m = _metric_record(stream, projection.metrics)
+                if m is not None:
+                    yield "metric", m
+        elif key == "workouts" and stream.peek() == "[":
+            for _ in stream.iter_array():
+                yield "workout", _workout_record(stream, projection.workout_keys)
+        elif key == "data" and stream.peek() == "{":
+            # HealthAutoExport typically nests under "data"
+            yield from _iter_root(stream, projection)
+        else:
+            stream.skip()
+
+def iter_export_records(
+    path: Path, chunk_size: int = 1 << 20, projection: Projection | None = None
+) -> Iterator[Record]:
+    """
+    Streams ("metric", m) and ("workout", w) records out of one export.
+    Peak memory is the largest single record, not the file size; with a
+    projection, unwanted metrics and workout fields are skipped undecoded.
+    """
+    projection = projection or Projection()
+    for f in export_streams(path):
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        yield from _iter_root(_JsonStream(text, chunk_size), projection)
+        text.detach()
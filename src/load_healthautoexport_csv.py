@@ -0,0 +1,91 @@
+from __future__ import annotations
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import pandas as pd
+
+from .load_healthautoexport import Record
+
+# HealthAutoExport CSV ("Health Metrics" format): one "Date/Time" column and
+# one column per metric field, e.g.
+#   Heart Rate Variability (ms), Heart Rate [Avg] (count/min),
+#   Sleep Analysis [Total] (hr), Sleep Analysis [Awake] (hr)
+# Headers map onto the JSON names: "Heart Rate Variability" ->
+# heart_rate_variability with value key qty, "Heart Rate [Avg]" ->
+# heart_rate with key Avg. Columns are parsed by pandas in bulk and handed
+# on as columnar batches, never one dict per sample.
+CSV_PATTERN = "HealthAutoExport-*.csv"
+DATE_COLUMN = "Date/Time"
+_HEADER = re.compile(r"^\s*(?P<name>[^\[(]+?)\s*(?:\[(?P<field>[^\]]+)\])?\s*(?:\((?P<unit>[^)]*)\))?\s*$")
+# sleep_analysis fields the extractors read; [Asleep] only stands in for
+# totalSleep on nights without a [Total] column value
+SLEEP_FIELDS = {"total": "totalSleep", "asleep": "asleep", "awake": "awake"}
+
+def csv_paths(data_dir: str = "data") -> List[Path]:
+    return sorted(Path(data_dir).glob(CSV_PATTERN))
+
+def parse_header(header: str) -> tuple[str, str] | None:
+    """(metric name, value key) for a CSV column header, None if unrecognised."""
+    m = _HEADER.match(header)
+    if not m:
+        return None
+    name = re.sub(r"\W+", "_", m.group("name").strip().lower()).strip("_")
+    field = m.group("field")
+    if name == "sleep_analysis":
+        key = SLEEP_FIELDS.get((field or "total").strip().lower())
+        return (name, key) if key else None
+    return name, field.strip() if field else "qty"
+
+def load_csv_samples(path: str | Path) -> pd.DataFrame:
+    """
+    Long (date, metric, key, value) samples from one CSV export; date is
+    the timestamp text as written, empty cells are dropped.
+    """
+    df = pd.read_csv(path, dtype={DATE_COLUMN: str})
+    columns = {c: parse_header(c) for c in df.columns if c != DATE_COLUMN}
+    columns = {c: mk for c, mk in columns.items() if mk is not None}
+    long = df[[DATE_COLUMN] + list(columns)].melt(id_vars=DATE_COLUMN, var_name="column", value_name="value")
+    long = long.dropna(subset=[DATE_COLUMN, "value"])
+    long["value"] = pd.to_numeric(long["value"], errors="coerce")
+    long = long.dropna(subset=["value"])
+    names = {c: mk[0] for c, mk in columns.items()}
+    keys = {c: mk[1] for c, mk in columns.items()}
+    return pd.DataFrame({
+        "date": long[DATE_COLUMN].to_numpy(),
+        "metric": long["column"].map(names).to_numpy(),
+        "key": long["column"].map(keys).to_numpy(),
+        "value": long["value"].to_numpy(dtype="float64"),
+    })
+
+def _batches(samples: pd.DataFrame) -> Iterator[Dict[str, Any]]:
+    sleep = samples["metric"] == "sleep_analysis"
+    for (name, key), g in samples[~sleep].groupby(["metric", "key"], sort=False):
+        yield {"name": name, "key": key, "date": g["date"].tolist(), "value": g["value"].tolist()}
+
+    if sleep.any():
+        # one row per night: totalSleep (else asleep) required, awake defaults to 0
+        wide = samples[sleep].pivot_table(index="date", columns="key", values="value", aggfunc="last")
+        missing = pd.Series(float("nan"), index=wide.index)
+        total = wide.get("totalSleep", missing).combine_first(wide.get("asleep", missing))
+        keep = total.notna()
+        if keep.any():
+            awake = wide.get("awake", missing).fillna(0.0)
+            yield {
+                "name": "sleep_analysis",
+                "date": wide.index[keep].tolist(),
+                "totalSleep": total[keep].tolist(),
+                "awake": awake[keep].tolist(),
+            }
+
+def iter_csv_records(path: str | Path) -> Iterator[Record]:
+    """("samples", batch) records, one batch per metric field."""
+    for batch in _batches(load_csv_samples(path)):
+        yield "samples", batch
+
+def load_csv_payload(path: str | Path) -> Dict[str, Any]:
+    """A payload build_phase1_daily accepts alongside JSON ones."""
+    return {"data": {"samples": list(_batches(load_csv_samples(path)))}}
+
+def load_csv_payloads(data_dir: str = "data") -> List[Dict[str, Any]]:
+    return [load_csv_payload(p) for p in csv_paths(data_dir)]
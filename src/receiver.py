@@ -0,0 +1,154 @@
+"""
+Local receiver for HealthAutoExport's REST API automation:
+
+    python -m src.receiver [data_dir] [--host 127.0.0.1] [--port 8787] [--token T]
+
+Point the automation (JSON format) at http://<host>:<port>/. Each POST is
+checked, appended to the push log and synced to disk before it is
+acknowledged; a background thread applies the log to the sample store in
+batches and marks the days it touched dirty, which the dashboard picks up
+on its next refresh without rescanning the exports.
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import hmac
+import json
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .export_cache import push_log_path
+from .load_healthautoexport import get_root, json_loads
+from .sample_store import append_push, apply_push_log, check_push, connect, default_db_path, truncate_push_log
+
+# A month of per-minute metrics is a few MB; anything much bigger is a mistake
+MAX_BODY_BYTES = 256 << 20
+
+class PushLog:
+    """Appends pushes to the log and applies them to the store in batches."""
+
+    def __init__(self, data_dir: str = "data", batch_seconds: float = 2.0):
+        self.log_path = push_log_path(data_dir)
+        self.db_path = default_db_path(data_dir)
+        self.batch_seconds = batch_seconds
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="push-apply", daemon=True)
+
+    def start(self) -> None:
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        truncate_push_log(self.log_path)
+        # anything logged but not applied before the last shutdown
+        self._pending.set()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._pending.set()
+        self._thread.join()
+
+    def append(self, body: bytes) -> None:
+        with self._lock:
+            append_push(self.log_path, body)
+        self._pending.set()
+
+    def _run(self) -> None:
+        conn = connect(self.db_path)
+        try:
+            while True:
+                self._pending.wait()
+                # let a burst of pushes land, then apply them in one transaction
+                self._stop.wait(self.batch_seconds)
+                self._pending.clear()
+                try:
+                    apply_push_log(conn, self.log_path)
+                except Exception:
+                    # the pushes stay in the log; the next batch (or the dashboard) retries
+                    traceback.print_exc()
+                if self._stop.is_set():
+                    break
+        finally:
+            conn.close()
+
+def check_payload(body: bytes) -> str | None:
+    """Why body is not a HealthAutoExport JSON payload, or None when it is."""
+    try:
+        payload = json_loads(body)
+    except ValueError:
+        return "body is not JSON"
+    if not isinstance(payload, dict):
+        return "expected a JSON object"
+    root = get_root(payload)
+    if not isinstance(root, dict) or not ({"metrics", "workouts"} & root.keys()):
+        return "no metrics or workouts in payload"
+    # a push the store cannot take is refused here, never acknowledged
+    try:
+        check_push(payload)
+    except ValueError as e:
+        return f"unusable payload data: {e}"
+    return None
+
+def make_handler(log: PushLog, token: str | None = None):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            if token is not None:
+                given = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+                if not hmac.compare_digest(given.encode(), token.encode()):
+                    return self._reply(401, {"error": "bad token"})
+            length = int(self.headers.get("Content-Length") or 0)
+            if not 0 < length <= MAX_BODY_BYTES:
+                return self._reply(413 if length else 411, {"error": "missing or oversized body"})
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Encoding", "").lower() == "gzip":
+                try:
+                    body = gzip.decompress(body)
+                except (OSError, EOFError):
+                    return self._reply(400, {"error": "bad gzip body"})
+            error = check_payload(body)
+            if error:
+                return self._reply(400, {"error": error})
+            log.append(body)
+            self._reply(200, {"accepted": len(body)})
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    return Handler
+
+def serve(data_dir: str = "data", host: str = "127.0.0.1", port: int = 8787,
+          token: str | None = None, batch_seconds: float = 2.0) -> None:
+    log = PushLog(data_dir, batch_seconds)
+    log.start()
+    server = ThreadingHTTPServer((host, port), make_handler(log, token))
+    print(f"Receiving HealthAutoExport pushes on http://{host}:{port}/ into {Path(data_dir).resolve()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        log.stop()
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("data_dir", nargs="?", default="data")
+    ap.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to accept pushes from the phone over the LAN")
+    ap.add_argument("--port", type=int, default=8787)
+    ap.add_argument("--token", help="require 'Authorization: Bearer <token>' on every push")
+    ap.add_argument("--batch-seconds", type=float, default=2.0)
+    args = ap.parse_args()
+    serve(args.data_dir, args.host, args.port, args.token, args.batch_seconds)
+
+if __name__ == "__main__":
+    main()
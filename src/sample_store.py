@@ -0,0 +1,440 @@
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import warnings
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import STATE_COLUMNS, aggregate_samples, empty_partial, merge_partials
+from .compute_phase1 import (
+    HR_RESOLUTION_S,
+    METRICS,
+    ZONE_COLUMNS,
+    feed_record,
+    new_columns,
+    workout_rows,
+    workouts_from_columns,
+)
+from .export_cache import default_cache_dir
+from .load_healthautoexport import iter_payload_records, json_loads
+from .timestamps import day_range, parse_local
+from .workouts import WorkoutHR
+
+# Local SQLite store of the samples pushed to the receiver (see Push log
+# below). Exports in data_dir are not ingested here: each is parsed once into
+# the partial cache (export_cache), which already spares loads from
+# re-reading raw JSON. load_daily reads pushed data by day window through
+# push_partials / query_partials, so only the days a push touched are queried.
+# Timestamps are local-naive epoch seconds and days are local-naive epoch
+# days (ts // 86400), so window queries are plain integer ranges.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    metric TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    value REAL NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_metric_ts ON samples (metric, ts);
+CREATE INDEX IF NOT EXISTS samples_source ON samples (source);
+CREATE TABLE IF NOT EXISTS sleep (
+    ts INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    total_hr REAL NOT NULL,
+    awake_hr REAL NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sleep_ts ON sleep (ts);
+CREATE INDEX IF NOT EXISTS sleep_source ON sleep (source);
+CREATE TABLE IF NOT EXISTS workouts (
+    id INTEGER PRIMARY KEY,
+    day INTEGER,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS workouts_day ON workouts (day);
+CREATE INDEX IF NOT EXISTS workouts_source ON workouts (source);
+CREATE TABLE IF NOT EXISTS workout_hr (
+    workout_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    bpm REAL NOT NULL,
+    bpm_min REAL NOT NULL,
+    bpm_max REAL NOT NULL,
+    bpm_peak REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS workout_hr_workout_ts ON workout_hr (workout_id, ts);
+CREATE TABLE IF NOT EXISTS pushes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    log_end INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dirty_days (
+    day INTEGER PRIMARY KEY,
+    push INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rejected_pushes (
+    log_end INTEGER PRIMARY KEY,
+    error TEXT NOT NULL
+);
+"""
+
+# Bump when SCHEMA or what gets stored changes; older stores are rebuilt.
+# Workout HR is stored resampled, so HR_RESOLUTION_S is part of the version
+# too (see store_version)
+STORE_VERSION = 7
+TABLES = ["sources", "samples", "sleep", "workouts", "workout_hr", "pushes", "dirty_days", "rejected_pushes"]
+SECONDS_PER_DAY = 86400
+
+def default_db_path(data_dir: str = "data") -> Path:
+    return default_cache_dir(data_dir) / "samples.sqlite"
+
+def store_version() -> int:
+    """PRAGMA user_version of a store built by this code and HR_RESOLUTION_S."""
+    config = hashlib.sha256(repr((STORE_VERSION, HR_RESOLUTION_S)).encode()).hexdigest()
+    return int(config[:7], 16)
+
+def connect(db_path: str | Path) -> sqlite3.Connection:
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != store_version():
+        # the store only holds data replayed from the push log: rebuild it
+        with conn:
+            for table in TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"PRAGMA user_version = {store_version()}")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _epoch_seconds(times) -> np.ndarray:
+    return np.asarray(times, dtype="datetime64[s]").astype("int64")
+
+def _epoch_days(times) -> np.ndarray:
+    return np.asarray(times, dtype="datetime64[D]").astype("int64")
+
+# ----------------------------
+# Ingestion
+# ----------------------------
+def write_columns(conn: sqlite3.Connection, source: str, cols: dict) -> None:
+    """
+    Inserts demuxed columns (see compute_phase1.new_columns) for one source.
+    """
+    for name, col in cols["metrics"].items():
+        if not col["date"]:
+            continue
+        ts = _epoch_seconds(parse_local(col["date"]))
+        conn.executemany(
+            "INSERT INTO samples (metric, ts, day, value, source) VALUES (?, ?, ?, ?, ?)",
+            zip([name] * len(ts), ts.tolist(), (ts // SECONDS_PER_DAY).tolist(), col["value"], [source] * len(ts)),
+        )
+
+    sleep = cols["sleep"]
+    if sleep["date"]:
+        ts = _epoch_seconds(parse_local(sleep["date"]))
+        conn.executemany(
+            "INSERT INTO sleep (ts, day, total_hr, awake_hr, source) VALUES (?, ?, ?, ?, ?)",
+            zip(ts.tolist(), (ts // SECONDS_PER_DAY).tolist(), sleep["total"], sleep["awake"], [source] * len(ts)),
+        )
+
+    if cols["workouts"]["spans"]:
+        # stored already resampled to HR_RESOLUTION_S
+        wh = workouts_from_columns(cols["workouts"])
+        for i in range(wh.n_workouts):
+            a, b = int(wh.offsets[i]), int(wh.offsets[i + 1])
+            day = None if np.isnat(wh.day[i]) else int(_epoch_days(wh.day[i]))
+            wid = conn.execute("INSERT INTO workouts (day, source) VALUES (?, ?)", (day, source)).lastrowid
+            conn.executemany(
+                "INSERT INTO workout_hr (workout_id, ts, bpm, bpm_min, bpm_max, bpm_peak) VALUES (?, ?, ?, ?, ?, ?)",
+                zip([wid] * (b - a), wh.ts[a:b].tolist(), wh.bpm[a:b].tolist(),
+                    wh.bpm_min[a:b].tolist(), wh.bpm_max[a:b].tolist(), wh.bpm_peak[a:b].tolist()),
+            )
+
+def delete_source(conn: sqlite3.Connection, source: str) -> None:
+    conn.execute("DELETE FROM samples WHERE source = ?", (source,))
+    conn.execute("DELETE FROM sleep WHERE source = ?", (source,))
+    conn.execute(
+        "DELETE FROM workout_hr WHERE workout_id IN (SELECT id FROM workouts WHERE source = ?)", (source,)
+    )
+    conn.execute("DELETE FROM workouts WHERE source = ?", (source,))
+
+def ingest_records(conn: sqlite3.Connection, source: str, records, flush_every: int = 250_000) -> None:
+    cols = new_columns(METRICS)
+    for kind, rec in records:
+        feed_record(cols, kind, rec)
+        if cols["n"] >= flush_every:
+            write_columns(conn, source, cols)
+            cols = new_columns(METRICS)
+    write_columns(conn, source, cols)
+
+# ----------------------------
+# Push log
+# ----------------------------
+# Payloads POSTed to the receiver are appended to the push log as
+# "<length>\n<body>\n" frames, fsynced before they are acknowledged.
+# apply_push_log moves new frames into the store under PUSH_SOURCE and
+# records how far it got (pushes.log_end) in the same transaction, so each
+# frame is applied exactly once and a rebuilt store replays the whole log.
+# Automations resend the current day on every run: a pushed sample with
+# the metric and timestamp of an earlier one replaces it. Every day a push
+# touches is marked in dirty_days until the daily frame has picked it up.
+# A frame that cannot be stored (bad dates or values) is skipped and kept in
+# rejected_pushes, so it never blocks the frames behind it.
+PUSH_SOURCE = "push"
+_STAGING = "push:staging"
+# what malformed payload data raises while being fed, parsed or stored
+_BAD_DATA = (ValueError, TypeError, AttributeError, KeyError, OverflowError, sqlite3.IntegrityError)
+
+def check_push(payload: dict) -> None:
+    """
+    Raises ValueError when the payload holds data the store cannot take:
+    the same feeding and timestamp parsing _apply_push does, without
+    writing anything.
+    """
+    try:
+        cols = new_columns(METRICS)
+        for kind, rec in iter_payload_records([payload]):
+            feed_record(cols, kind, rec)
+        values = [v for col in cols["metrics"].values() for v in col["value"]]
+        values += cols["sleep"]["total"] + cols["sleep"]["awake"]
+        if not np.isfinite(np.asarray(values, dtype="float64")).all():
+            raise ValueError("non-finite value")
+        for dates in [col["date"] for col in cols["metrics"].values()] + [cols["sleep"]["date"]]:
+            parse_local(dates)
+        workouts_from_columns(cols["workouts"])
+    except _BAD_DATA as e:
+        raise ValueError(f"{type(e).__name__}: {e}") from None
+
+def append_push(log_path: str | Path, body: bytes) -> int:
+    """Appends one payload to the log and syncs it to disk; returns the new log size."""
+    with open(log_path, "ab") as f:
+        f.write(b"%d\n" % len(body) + body + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+def iter_push_log(log_path: str | Path, start: int = 0):
+    """
+    (end offset, body) of each complete frame after `start`. A frame still
+    being written (or torn by a crash) ends the iteration.
+    """
+    with open(log_path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while True:
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                return
+            n = int(header)
+            body = f.read(n + 1)
+            if len(body) < n + 1:
+                return
+            pos += len(header) + n + 1
+            yield pos, body[:n]
+
+def truncate_push_log(log_path: str | Path) -> None:
+    """Cuts a torn frame off the end of the log, so new frames follow whole ones."""
+    log_path = Path(log_path)
+    if not log_path.exists():
+        return
+    end = 0
+    for end, _ in iter_push_log(log_path):
+        pass
+    if end < log_path.stat().st_size:
+        with open(log_path, "r+b") as f:
+            f.truncate(end)
+
+def _source_days(conn: sqlite3.Connection, source: str) -> list[int]:
+    rows = conn.execute(
+        """SELECT day FROM samples WHERE source = ?
+           UNION SELECT day FROM sleep WHERE source = ?
+           UNION SELECT day FROM workouts WHERE source = ? AND day IS NOT NULL""",
+        (source, source, source),
+    )
+    return [row[0] for row in rows]
+
+def _mark_dirty(conn: sqlite3.Connection, days, push_id: int) -> None:
+    conn.executemany("INSERT OR REPLACE INTO dirty_days (day, push) VALUES (?, ?)", ((d, push_id) for d in days))
+
+def _apply_push(conn: sqlite3.Connection, payload: dict, push_id: int) -> list[int]:
+    ingest_records(conn, _STAGING, iter_payload_records([payload]))
+    # drop earlier copies of what was just resent
+    conn.execute(
+        """DELETE FROM samples WHERE rowid IN (
+               SELECT o.rowid FROM samples n JOIN samples o ON o.metric = n.metric AND o.ts = n.ts
+               WHERE n.source = ? AND o.source = ?)""",
+        (_STAGING, PUSH_SOURCE),
+    )
+    conn.execute(
+        """DELETE FROM sleep WHERE rowid IN (
+               SELECT o.rowid FROM sleep n JOIN sleep o ON o.ts = n.ts
+               WHERE n.source = ? AND o.source = ?)""",
+        (_STAGING, PUSH_SOURCE),
+    )
+    # workouts are matched on their first heart-rate bucket
+    start = "SELECT w.id, (SELECT MIN(ts) FROM workout_hr h WHERE h.workout_id = w.id) AS t0 FROM workouts w WHERE w.source = ?"
+    resent = [row[0] for row in conn.execute(
+        f"SELECT o.id FROM ({start}) o JOIN ({start}) n ON o.t0 = n.t0", (PUSH_SOURCE, _STAGING)
+    )]
+    conn.executemany("DELETE FROM workout_hr WHERE workout_id = ?", ((i,) for i in resent))
+    conn.executemany("DELETE FROM workouts WHERE id = ?", ((i,) for i in resent))
+
+    days = _source_days(conn, _STAGING)
+    for table in ("samples", "sleep", "workouts"):
+        conn.execute(f"UPDATE {table} SET source = ? WHERE source = ?", (PUSH_SOURCE, _STAGING))
+    _mark_dirty(conn, days, push_id)
+    return days
+
+def apply_push_log(conn: sqlite3.Connection, log_path: str | Path) -> list[int]:
+    """
+    Ingests the log frames the store has not seen yet, in one transaction;
+    returns the days they touched. A log that shrank (replaced or deleted)
+    drops all pushed data and is replayed from the start. A frame whose
+    data cannot be stored is rolled back on its own and recorded in
+    rejected_pushes; the frames after it still apply.
+    """
+    log_path = Path(log_path)
+    size = log_path.stat().st_size if log_path.exists() else 0
+    days: set = set()
+    with conn:
+        # take the write lock first: the receiver and the dashboard may both apply
+        conn.execute("BEGIN IMMEDIATE")
+        applied = conn.execute("SELECT COALESCE(MAX(log_end), 0) FROM pushes").fetchone()[0]
+        if size < applied:
+            forgotten = _source_days(conn, PUSH_SOURCE)
+            delete_source(conn, PUSH_SOURCE)
+            conn.execute("DELETE FROM pushes")
+            conn.execute("DELETE FROM rejected_pushes")
+            push_id = conn.execute("INSERT INTO pushes (log_end) VALUES (0)").lastrowid
+            _mark_dirty(conn, forgotten, push_id)
+            days.update(forgotten)
+            applied = 0
+        if size > applied:
+            for end, body in iter_push_log(log_path, applied):
+                push_id = conn.execute("INSERT INTO pushes (log_end) VALUES (?)", (end,)).lastrowid
+                conn.execute("SAVEPOINT frame")
+                try:
+                    days.update(_apply_push(conn, json_loads(body), push_id))
+                except _BAD_DATA as e:
+                    conn.execute("ROLLBACK TO frame")
+                    error = f"{type(e).__name__}: {e}"
+                    conn.execute("INSERT OR REPLACE INTO rejected_pushes (log_end, error) VALUES (?, ?)", (end, error))
+                    warnings.warn(f"{log_path}: skipped the push ending at byte {end}: {error}")
+                conn.execute("RELEASE frame")
+    return sorted(days)
+
+def rejected_pushes(conn: sqlite3.Connection) -> list[tuple[int, str]]:
+    """(log end offset, error) of every frame apply_push_log skipped."""
+    return conn.execute("SELECT log_end, error FROM rejected_pushes ORDER BY log_end").fetchall()
+
+def pushed_day_range(conn: sqlite3.Connection) -> tuple[int, int] | None:
+    """First and last day holding pushed data, or None when nothing was pushed."""
+    lo, hi = conn.execute(
+        """SELECT MIN(day), MAX(day) FROM (
+               SELECT day FROM samples WHERE source = ?
+               UNION ALL SELECT day FROM sleep WHERE source = ?
+               UNION ALL SELECT day FROM workouts WHERE source = ? AND day IS NOT NULL)""",
+        (PUSH_SOURCE,) * 3,
+    ).fetchone()
+    return None if lo is None else (lo, hi)
+
+def dirty_days(conn: sqlite3.Connection) -> tuple[list[int], int]:
+    """Days changed by pushes and not yet cleared, and the newest push among them."""
+    rows = conn.execute("SELECT day, push FROM dirty_days").fetchall()
+    return sorted(row[0] for row in rows), max((row[1] for row in rows), default=0)
+
+def clear_dirty_days(conn: sqlite3.Connection, days, upto: int) -> None:
+    """Unmarks `days`, unless a push newer than `upto` has touched them since."""
+    with conn:
+        conn.executemany("DELETE FROM dirty_days WHERE day = ? AND push <= ?", ((d, upto) for d in days))
+
+# ----------------------------
+# Window queries
+# ----------------------------
+def _states_query(conn: sqlite3.Connection, sql: str, params: Iterable) -> pd.DataFrame:
+    df = pd.read_sql_query(sql, conn, params=list(params))
+    if df.empty:
+        return empty_partial()
+    df["date"] = pd.to_datetime(df.pop("day"), unit="D")
+    df[STATE_COLUMNS] = df[STATE_COLUMNS].astype("float64")
+    return df
+
+def query_partials(conn: sqlite3.Connection, start=None, end=None, source: str | None = None) -> pd.DataFrame:
+    """
+    Per-day aggregate states for [start, end] (inclusive days; None = open),
+    from every source or only `source`.
+    Sample and sleep states are aggregated in SQL over the (metric, ts) and
+    ts indexes; only the window's workout HR buckets are read back.
+    """
+    lo, hi = day_range(start, end)
+    ts_lo, ts_hi = lo * SECONDS_PER_DAY, (hi + 1) * SECONDS_PER_DAY
+    # optional source filter, for the samples / sleep / workouts queries
+    only = " AND {}source = ?" if source is not None else ""
+    src = (source,) if source is not None else ()
+    parts = []
+
+    for spec in METRICS:
+        # "last" is the value of the day's latest sample (highest rowid on ties)
+        parts.append(_states_query(
+            conn,
+            f"""SELECT day, metric, SUM(value) AS sum, COUNT(*) AS count, MIN(value) AS min,
+                       MAX(value) AS max, SUM(value * value) AS sumsq, MAX(ts) AS last_ts,
+                       (SELECT l.value FROM samples l
+                        WHERE l.metric = s.metric AND l.ts >= s.day * ? AND l.ts < (s.day + 1) * ?{only.format("l.")}
+                        ORDER BY l.ts DESC, l.rowid DESC LIMIT 1) AS last
+                FROM samples s WHERE metric = ? AND ts >= ? AND ts < ?{only.format("")}
+                GROUP BY day""",
+            (SECONDS_PER_DAY, SECONDS_PER_DAY, *src, spec.column, ts_lo, ts_hi, *src),
+        ))
+
+    for col in ("total_hr", "awake_hr"):
+        parts.append(_states_query(
+            conn,
+            f"""SELECT day, 'sleep_{col}' AS metric, SUM({col}) AS sum, COUNT(*) AS count,
+                       MIN({col}) AS min, MAX({col}) AS max, SUM({col} * {col}) AS sumsq,
+                       NULL AS last_ts, NULL AS last
+                FROM sleep WHERE ts >= ? AND ts < ?{only.format("")}
+                GROUP BY day""",
+            (ts_lo, ts_hi, *src),
+        ))
+
+    hr = pd.read_sql_query(
+        f"""SELECT h.workout_id, h.ts, h.bpm, h.bpm_min, h.bpm_max, h.bpm_peak, w.day
+            FROM workouts w JOIN workout_hr h ON h.workout_id = w.id
+            WHERE w.day BETWEEN ? AND ?{only.format("w.")}
+            ORDER BY h.workout_id, h.ts, h.rowid""",
+        conn,
+        params=[lo, hi, *src],
+    )
+    if not hr.empty:
+        # rows arrive grouped by workout and sorted by ts: already ragged form
+        ids = hr["workout_id"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        wh = WorkoutHR(
+            ts=hr["ts"].to_numpy(dtype="int64"),
+            bpm=hr["bpm"].to_numpy(dtype="float32"),
+            bpm_min=hr["bpm_min"].to_numpy(dtype="float32"),
+            bpm_max=hr["bpm_max"].to_numpy(dtype="float32"),
+            bpm_peak=hr["bpm_peak"].to_numpy(dtype="float32"),
+            offsets=np.r_[starts, len(ids)].astype("int64"),
+            day=hr["day"].to_numpy(dtype="int64")[starts].astype("datetime64[D]"),
+        )
+        workouts, hrr = workout_rows(wh)
+        if not workouts.empty:
+            parts.append(aggregate_samples(workouts[["date"] + ZONE_COLUMNS]))
+            parts.append(aggregate_samples(hrr))
+
+    return merge_partials(parts)
+
+def push_partials(conn: sqlite3.Connection, days=None) -> pd.DataFrame:
+    """Per-day states of the pushed data alone; with `days` (epoch day numbers) only those days."""
+    if days is None:
+        return query_partials(conn, source=PUSH_SOURCE)
+    if not days:
+        return empty_partial()
+    lo, hi = min(days), max(days)
+    states = query_partials(conn, np.datetime64(lo, "D"), np.datetime64(hi, "D"), source=PUSH_SOURCE)
+    wanted = pd.DatetimeIndex(np.array(sorted(days), dtype="datetime64[D]"))
+    return states[states["date"].isin(wanted)]
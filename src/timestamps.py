@@ -0,0 +1,52 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from dateutil import parser
+
+# HealthAutoExport writes every timestamp as "YYYY-MM-DD HH:MM:SS ±ZZZZ"
+# in JSON, and without the offset in CSV.
+_HAE_LEN = 25
+_WALL_LEN = 19
+_HAE_WALL = "%Y-%m-%d %H:%M:%S"
+
+def parse_local(values) -> np.ndarray:
+    """
+    Bulk-parse timestamp strings to local-naive datetime64[ns].
+    Same result as parser.parse(ts).replace(tzinfo=None) per row: the
+    offset is dropped and the wall-clock time kept.
+    Rows in the HealthAutoExport formats are converted in one vectorized
+    call; only rows that don't match fall back to dateutil.
+    """
+    s = pd.Series(values, dtype=object)
+    out = np.full(len(s), np.datetime64("NaT"), dtype="datetime64[ns]")
+    if s.empty:
+        return out
+
+    text = s.astype(str)
+    n = text.str.len()
+    fast = (
+        ((n == _HAE_LEN) & (text.str.slice(19, 20) == " ") & text.str.slice(20, 21).isin(["+", "-"]))
+        | (n == _WALL_LEN)
+    ).to_numpy()
+    if fast.any():
+        wall = pd.to_datetime(text[fast].str.slice(0, 19), format=_HAE_WALL, errors="coerce")
+        out[fast] = wall.to_numpy(dtype="datetime64[ns]")
+
+    slow = np.flatnonzero(~fast | np.isnat(out))
+    for i in slow:
+        out[i] = np.datetime64(parser.parse(text.iat[i]).replace(tzinfo=None), "ns")
+    return out
+
+def to_days(values) -> np.ndarray:
+    # normalize to local-naive day
+    return parse_local(values).astype("datetime64[D]").astype("datetime64[ns]")
+
+def day_number(day) -> int:
+    # local-naive epoch day of a date / timestamp / "YYYY-MM-DD"
+    return int(np.datetime64(pd.Timestamp(day).normalize(), "D").astype("int64"))
+
+def day_range(start, end) -> tuple[int, int]:
+    """Inclusive epoch-day bounds of a [start, end] window; None is open."""
+    lo = day_number(start) if start is not None else -(1 << 40)
+    hi = day_number(end) if end is not None else (1 << 40)
+    return lo, hi
@@ -0,0 +1,148 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from src.compute_phase1 import build_phase1_daily
+from src.daily_cache import load_daily
+from src.export_cache import default_cache_dir, read_manifest
+from src.load_healthautoexport import load_payloads
+
+def ts(day: int, seconds: int = 0) -> str:
+    t = pd.Timestamp("2024-01-01") + pd.Timedelta(days=day, seconds=seconds)
+    return t.strftime("%Y-%m-%d %H:%M:%S") + " -0500"
+
+def export(first_day: int, days: int = 6) -> dict:
+    """A small HealthAutoExport payload whose days overlap the next file's."""
+    span = range(first_day, first_day + days)
+    metrics = [
+        {"name": "heart_rate_variability", "units": "ms",
+         "data": [{"date": ts(d, 3600 * h), "qty": 30 + d + h} for d in span for h in (1, 9)]},
+        {"name": "resting_heart_rate", "units": "count/min", "data": [{"date": ts(d, 600), "qty": 50 + d % 7} for d in span]},
+        {"name": "sleep_analysis", "units": "hr",
+         "data": [{"date": ts(d, 7 * 3600), "totalSleep": 6 + d % 3, "awake": 0.25} for d in span]},
+    ]
+    workouts = []
+    for d in span[::2]:
+        start = 18 * 3600
+        hr = [{"date": ts(d, start + 5 * i), "Avg": 100 + 60 * min(i, 240) / 240 - (i > 240) * (i - 240) / 4}
+              for i in range(360)]
+        workouts.append({"name": "Run", "start": ts(d, start), "end": ts(d, start + 1800), "heartRateData": hr})
+    return {"data": {"metrics": metrics, "workouts": workouts}}
+
+def write(path, payload) -> None:
+    path.write_text(json.dumps(payload))
+
+def assert_matches_full_rebuild(data_dir) -> None:
+    got = load_daily(str(data_dir)).reset_index(drop=True)
+    full = build_phase1_daily(load_payloads(str(data_dir))).reset_index(drop=True)
+    pd.testing.assert_frame_equal(got, full, check_dtype=False)
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for first_day in (0, 4, 8):
+        write(tmp_path / f"HealthAutoExport-{ts(first_day)[:10]}.json", export(first_day))
+    assert_matches_full_rebuild(tmp_path)
+    return tmp_path
+
+def exports(data_dir) -> list:
+    return sorted(data_dir.glob("HealthAutoExport-*.json"))
+
+def test_edit(data_dir):
+    path = exports(data_dir)[1]
+    payload = json.loads(path.read_text())
+    payload["data"]["metrics"][0]["data"] = payload["data"]["metrics"][0]["data"][::3]
+    payload["data"]["workouts"].pop()
+    write(path, payload)
+    assert_matches_full_rebuild(data_dir)
+
+def test_removal(data_dir):
+    exports(data_dir)[1].unlink()
+    assert_matches_full_rebuild(data_dir)
+
+def test_touch(data_dir):
+    path = exports(data_dir)[0]
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert_matches_full_rebuild(data_dir)
+
+def test_missing_partial_of_a_touched_export(data_dir):
+    path = exports(data_dir)[2]
+    cache_dir = default_cache_dir(str(data_dir))
+    (cache_dir / read_manifest(cache_dir)[str(path)]["partial"]).unlink()
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert_matches_full_rebuild(data_dir)
+    assert (cache_dir / read_manifest(cache_dir)[str(path)]["partial"]).exists()
+
+def test_edits_in_a_row(data_dir):
+    paths = exports(data_dir)
+    write(paths[0], export(1, days=3))
+    assert_matches_full_rebuild(data_dir)
+    paths[2].unlink()
+    assert_matches_full_rebuild(data_dir)
+    write(data_dir / "HealthAutoExport-2024-02-01.json", export(30))
+    assert_matches_full_rebuild(data_dir)
+
+def test_partial_write_killed_halfway_leaves_nothing_to_trust(tmp_path, monkeypatch):
+    write(tmp_path / "HealthAutoExport-2024-01-01.json", export(0))
+    real = pd.DataFrame.to_pickle
+
+    def killed(self, path, *args, **kwargs):
+        real(self, path, *args, **kwargs)
+        with open(path, "r+b") as f:
+            f.truncate(100)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pd.DataFrame, "to_pickle", killed)
+    with pytest.raises(KeyboardInterrupt):
+        load_daily(str(tmp_path))
+    monkeypatch.undo()
+    cache_dir = default_cache_dir(str(tmp_path))
+    assert list(cache_dir.glob("*.pkl*")) == []
+    assert_matches_full_rebuild(tmp_path)
+
+def test_concurrent_loads(data_dir):
+    write(data_dir / "HealthAutoExport-2024-02-01.json", export(30))
+    full = build_phase1_daily(load_payloads(str(data_dir))).reset_index(drop=True)
+    with ThreadPoolExecutor(4) as pool:
+        frames = list(pool.map(lambda _: load_daily(str(data_dir)), range(4)))
+    for got in frames:
+        pd.testing.assert_frame_equal(got.reset_index(drop=True), full, check_dtype=False)
+    assert sorted(p.name for p in default_cache_dir(str(data_dir)).iterdir() if ".tmp" in p.name or ".old" in p.name) == []
+
+def assert_matches_window(data_dir, history_days) -> None:
+    got = load_daily(str(data_dir), history_days=history_days).reset_index(drop=True)
+    full = build_phase1_daily(load_payloads(str(data_dir)))
+    full = full[full["date"] >= full["date"].max() - pd.Timedelta(days=history_days)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(got, full, check_dtype=False)
+
+def test_history_window(data_dir):
+    old = data_dir / "HealthAutoExport-2022-06-01.json"
+    write(old, export(-580))
+    assert_matches_window(data_dir, 5)
+    # exports ending before the window are never parsed
+    cache_dir = default_cache_dir(str(data_dir))
+    assert str(old) not in read_manifest(cache_dir)
+    # the window moves forward with new data, and back when it goes away
+    write(data_dir / "HealthAutoExport-2024-01-15.json", export(14))
+    assert_matches_window(data_dir, 5)
+    (data_dir / "HealthAutoExport-2024-01-15.json").unlink()
+    assert_matches_window(data_dir, 5)
+    assert str(old) not in read_manifest(cache_dir)
+    # a full load still sees everything
+    assert_matches_full_rebuild(data_dir)
+
+def test_history_window_when_a_filename_overstates_its_range(data_dir):
+    # named as if it ran into March, but its data stops mid-January
+    write(data_dir / "HealthAutoExport-2024-01-10-2024-03-01.json", export(9, days=3))
+    assert_matches_window(data_dir, 5)
+
+def test_parallel_extraction(data_dir):
+    write(data_dir / "HealthAutoExport-2024-02-01.json", export(30))
+    write(data_dir / "HealthAutoExport-2024-03-01.json", export(60))
+    got = load_daily(str(data_dir), workers=2).reset_index(drop=True)
+    full = build_phase1_daily(load_payloads(str(data_dir))).reset_index(drop=True)
+    pd.testing.assert_frame_equal(got, full, check_dtype=False)
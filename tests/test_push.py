@@ -0,0 +1,107 @@
+import json
+
+import pandas as pd
+import pytest
+
+from src.receiver import check_payload
+from src.sample_store import (
+    append_push,
+    apply_push_log,
+    connect,
+    dirty_days,
+    push_partials,
+    rejected_pushes,
+)
+
+def ts(day: int, hour: int = 8, minute: int = 0) -> str:
+    return f"2024-01-{day:02d} {hour:02d}:{minute:02d}:00 -0500"
+
+def push(day: int, rhr: float = 50.0) -> dict:
+    hr = [{"date": ts(day, 18, i), "Avg": 100 + i} for i in range(10)]
+    return {"data": {
+        "metrics": [
+            {"name": "resting_heart_rate", "data": [{"date": ts(day), "qty": rhr}]},
+            {"name": "sleep_analysis", "data": [{"date": ts(day, 7), "totalSleep": 7.0, "awake": 0.5}]},
+        ],
+        "workouts": [{"end": ts(day, 18, 10), "heartRateData": hr}],
+    }}
+
+def body(payload: dict) -> bytes:
+    return json.dumps(payload).encode()
+
+@pytest.fixture
+def store(tmp_path):
+    conn = connect(tmp_path / "samples.sqlite")
+    yield conn, tmp_path / "push.wal"
+    conn.close()
+
+def states(conn) -> pd.DataFrame:
+    return push_partials(conn).sort_values(["date", "metric"]).reset_index(drop=True)
+
+BAD = [
+    {"data": {"metrics": [{"name": "resting_heart_rate", "data": [{"date": "yesterday-ish", "qty": 50}]}]}},
+    {"data": {"metrics": [{"name": "resting_heart_rate", "data": [{"date": ts(1), "qty": "fifty"}]}]}},
+    {"data": {"metrics": ["resting_heart_rate"]}},
+    {"data": {"workouts": [{"end": ts(1), "heartRateData": [{"date": "soon", "Avg": 100}] * 6}]}},
+]
+
+@pytest.mark.parametrize("payload", BAD)
+def test_receiver_refuses_payloads_the_store_cannot_take(payload):
+    assert check_payload(body(payload)).startswith("unusable payload data")
+
+def test_receiver_accepts_a_push():
+    assert check_payload(body(push(1))) is None
+
+def test_bad_frame_is_skipped_and_does_not_block_the_rest(store):
+    conn, log = store
+    append_push(log, body(push(1)))
+    for payload in BAD:
+        append_push(log, body(payload))
+    end = append_push(log, body(push(2)))
+    with pytest.warns(UserWarning, match="skipped the push"):
+        days = apply_push_log(conn, log)
+    assert len(rejected_pushes(conn)) == len(BAD)
+    assert set(states(conn)["date"].dt.day) == {1, 2}
+    assert len(days) == 2
+    # applied once: nothing left to retry
+    assert apply_push_log(conn, log) == []
+    assert conn.execute("SELECT MAX(log_end) FROM pushes").fetchone()[0] == end
+
+def test_resent_push_replaces_the_earlier_copy(store):
+    conn, log = store
+    append_push(log, body(push(1)))
+    apply_push_log(conn, log)
+    once = states(conn)
+    append_push(log, body(push(1)))
+    apply_push_log(conn, log)
+    pd.testing.assert_frame_equal(states(conn), once)
+    # a resend with a corrected value wins
+    append_push(log, body(push(1, rhr=55.0)))
+    apply_push_log(conn, log)
+    rhr = states(conn).query("metric == 'resting_heart_rate'")
+    assert rhr["sum"].tolist() == [55.0] and rhr["count"].tolist() == [1.0]
+
+def test_rebuilt_store_replays_the_log(store, tmp_path):
+    conn, log = store
+    for day in (1, 2, 3):
+        append_push(log, body(push(day)))
+    apply_push_log(conn, log)
+    expected = states(conn)
+    fresh = connect(tmp_path / "other.sqlite")
+    assert apply_push_log(fresh, log) == sorted(dirty_days(conn)[0])
+    pd.testing.assert_frame_equal(states(fresh), expected)
+    fresh.close()
+
+def test_shrunk_log_drops_pushed_data_and_replays(store):
+    conn, log = store
+    for day in (1, 2, 3):
+        append_push(log, body(push(day)))
+    apply_push_log(conn, log)
+    before = dirty_days(conn)[0]
+    log.unlink()
+    append_push(log, body(push(5)))
+    days = apply_push_log(conn, log)
+    # the forgotten days come back dirty along with the new one
+    assert set(before) < set(days)
+    assert set(states(conn)["date"].dt.day) == {5}
+    assert set(dirty_days(conn)[0]) == set(days)
@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+
+from src.load_healthautoexport import Projection, _JsonStream, _iter_root, iter_export_records
+
+# strings full of the characters the skip regex and the bracket walk key on
+TRICKY = ['a]b', 'c}d', '[{', 'say "hi"]', 'back\\slash\\', '\\"]}', 'ünï ', '']
+
+def payload() -> dict:
+    return {
+        "data": {
+            "note": {"text": TRICKY, "nested": [[{"x": "]"}], {"y": ["}"]}]},
+            "metrics": [
+                {"name": "skipped", "units": "]", "data": [{"date": s, "qty": i} for i, s in enumerate(TRICKY)]},
+                {"name": "heart_rate_variability", "units": "ms", "data": [
+                    {"date": "2024-01-01 08:00:00 -0500", "qty": 41.25, "source": s} for s in TRICKY
+                ]},
+                {"data": [{"qty": 1e-3}], "name": "resting_heart_rate"},
+            ],
+            "workouts": [
+                {"name": "Run [outdoor]", "route": [{"lat": 1.5, "label": s} for s in TRICKY],
+                 "end": "2024-01-01 11:00:00 -0500", "heartRateData": [{"Avg": 120, "units": "{bpm}"}]},
+                {"name": "Yoga", "end": "2024-01-02 11:00:00 -0500", "extra": {"deep": [[[]], {}]}},
+            ],
+        }
+    }
+
+def records(text: str, chunk_size: int, projection: Projection) -> list:
+    return list(_iter_root(_JsonStream(io.StringIO(text), chunk_size), projection))
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 1])
+def test_stream_decodes_every_record_at_any_chunk_size(chunk_size, indent):
+    doc = payload()
+    text = json.dumps(doc, indent=indent, ensure_ascii=indent is None)
+    expected = [("metric", m) for m in doc["data"]["metrics"]] + [("workout", w) for w in doc["data"]["workouts"]]
+    assert records(text, chunk_size, Projection()) == expected
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 1 << 20])
+def test_projection_skips_values_with_brackets_in_strings(chunk_size):
+    doc = payload()
+    projection = Projection(metrics=frozenset({"heart_rate_variability", "resting_heart_rate"}),
+                            workout_keys=frozenset({"end", "heartRateData"}))
+    expected = [("metric", m) for m in doc["data"]["metrics"][1:]] + [
+        ("workout", {k: v for k, v in w.items() if k in projection.workout_keys}) for w in doc["data"]["workouts"]
+    ]
+    assert records(json.dumps(doc), chunk_size, projection) == expected
+
+@pytest.mark.parametrize("text", ['12345678', '-0.000125', '1.5e-07'])
+def test_numbers_cut_by_the_chunk_boundary(text):
+    stream = _JsonStream(io.StringIO(text), 1)
+    assert stream.value() == json.loads(text)
+
+def test_unterminated_container_is_an_error():
+    stream = _JsonStream(io.StringIO('{"metrics": [{"name": "a]"'), 2)
+    with pytest.raises(ValueError):
+        stream.skip()
+
+def test_export_file_round_trip(tmp_path):
+    doc = payload()
+    path = tmp_path / "HealthAutoExport-2024-01-01-2024-01-02.json"
+    path.write_text(json.dumps(doc), encoding="utf-8")
+    got = list(iter_export_records(path, chunk_size=3))
+    assert [r for _, r in got] == doc["data"]["metrics"] + doc["data"]["workouts"]
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from src import compute_phase1
+from src.compute_phase1 import ZONES, build_phase1_daily
+from src.workouts import build_workout_hr, hrr, resample, zone_codes, zone_minutes
+
+def one_hz_workout(minutes: int = 30, peak_at: int = 1500) -> tuple:
+    """Integer bpm at 1 Hz: a ramp to a peak, then an exponential recovery."""
+    n = minutes * 60
+    i = np.arange(n)
+    bpm = np.where(i < peak_at, 95 + 70 * i / peak_at, 165 - 40 * (1 - np.exp(-(i - peak_at) / 60)))
+    bpm = np.round(bpm + np.random.default_rng(0).normal(0, 2, n))
+    t = np.datetime64("2024-01-01T10:00:00") + i.astype("timedelta64[s]")
+    return build_workout_hr(t, bpm, [(0, n)], [np.datetime64("2024-01-01")]), n
+
+def test_zone_codes_cover_the_gaps_between_integer_edges():
+    codes = zone_codes([50, 105, 105.4, 106, 122.5, 148.9, 149, np.nan], ZONES)
+    assert codes.tolist() == [0, 0, 0, 1, 1, 3, 4, len(ZONES)]
+
+@pytest.mark.parametrize("resolution_s", [0, 5, 15, 60])
+def test_zone_time_does_not_depend_on_resolution(resolution_s):
+    wh, n = one_hz_workout()
+    minutes = zone_minutes(resample(wh, resolution_s), ZONES, 60)
+    assert minutes.sum() == pytest.approx(n / 60)
+
+def test_peak_survives_resampling():
+    wh, _ = one_hz_workout()
+    peak = wh.bpm_max.max()
+    for resolution_s in (5, 15, 60):
+        assert resample(wh, resolution_s).bpm_max.max() == peak
+
+@pytest.mark.parametrize("resolution_s", [5, 15])
+def test_hrr_at_fine_resolutions_tracks_the_unbinned_value(resolution_s):
+    # see workouts.hrr: the post-peak reading is a bin mean, the peak is exact
+    wh, _ = one_hz_workout()
+    exact = hrr(wh, [60, 120])[0]
+    binned = hrr(resample(wh, resolution_s), [60, 120])[0]
+    assert np.abs(binned - exact).max() <= 2.0
+
+def test_hrr_ignores_max_and_min():
+    # 1-minute export whose Max runs 6 bpm above Avg: HRR stays Avg - Avg
+    i = np.arange(30)
+    avg = np.where(i < 20, 100 + 3 * i, 157 - 5 * (i - 19)).astype(float)
+    t = np.datetime64("2024-01-01T10:00:00") + (60 * i).astype("timedelta64[s]")
+    day = [np.datetime64("2024-01-01")]
+    plain = build_workout_hr(t, avg, [(0, 30)], day)
+    with_max = build_workout_hr(t, avg, [(0, 30)], day, hr_min=avg - 4, hr_max=avg + 6)
+    expected = hrr(plain, [60])[0, 0]
+    assert expected == pytest.approx(5.0)
+    for resolution_s in (0, 5, 15, 60):
+        assert hrr(resample(with_max, resolution_s), [60])[0, 0] == pytest.approx(expected)
+
+def test_daily_hrr1_is_the_same_with_or_without_min_max():
+    def payload(extra: int | None) -> dict:
+        hr = []
+        for i in range(30):
+            avg = 100 + 3 * i if i < 20 else 157 - 5 * (i - 19)
+            point = {"date": f"2024-01-01 10:{i:02d}:00 -0500", "Avg": avg}
+            if extra is not None:
+                point.update(Min=avg - 4, Max=avg + extra)
+            hr.append(point)
+        return {"data": {"workouts": [{"end": "2024-01-01 10:30:00 -0500", "heartRateData": hr}]}}
+
+    plain = build_phase1_daily([payload(None)])
+    with_max = build_phase1_daily([payload(6)])
+    assert plain["hrr1"].tolist() == pytest.approx([5.0])
+    assert with_max["hrr1"].tolist() == plain["hrr1"].tolist()
+
+def one_hz_payload(seconds: int) -> dict:
+    hr = [{"date": f"2024-01-01 10:{i // 60:02d}:{i % 60:02d} -0500", "Avg": 130} for i in range(seconds)]
+    return {"data": {"workouts": [{"end": "2024-01-01 11:00:00 -0500", "heartRateData": hr}]}}
+
+@pytest.mark.parametrize("resolution_s", [0, 5, 15, 60])
+def test_minimum_bucket_rule_counts_exported_buckets(monkeypatch, resolution_s):
+    monkeypatch.setattr(compute_phase1, "HR_RESOLUTION_S", resolution_s)
+    # four minutes at 1 Hz is four 60 s bins, but 240 exported buckets
+    daily = build_phase1_daily([one_hz_payload(240)])
+    assert daily["cardio_min"].tolist() == pytest.approx([4.0])
+    assert build_phase1_daily([one_hz_payload(4)]).columns.tolist() == ["date"]